@@ -1,10 +1,17 @@
-from src.core.service.Mongo import Mongo
+from src.core.service.MongoFactory import MongoFactory
 from src.core.service.Configuration import Configuration
 from src.core.clone.Collection import Collection
 from src.core.clone.BasicCollectionPart import BasicCollectionPart
 from src.core.clone.OplogCollectionPart import OplogCollectionPart
+from src.core.clone.ChunkCollectionPart import ChunkCollectionPart
+from src.core.clone.CollectionPartBatch import CollectionPartBatch
+from src.core.clone.Spool import Spool
+from src.core.service.Profiler import Profiler
+from src.core.service.RateLimiter import RateLimiter
+from src.core.service.WorkQueue import WorkQueue, Heartbeat
 
 import multiprocessing as mp
+import time
 from queue import Empty as QueueEmpty
 
 """
@@ -16,37 +23,93 @@ def clone_collection_part(qi, qo, job_id, common_info):
 
     Configuration.FILEPATH = common_info['configuration_filepath']
     configuration = Configuration()
+    if common_info['profile']:
+        Profiler.enable(configuration, 'worker-'+str(job_id))
+    RateLimiter.enable(common_info['rate_limiter'])
     total = qi.qsize() # Only use that information for logging
     while True:
         try:
             data = qi.get(timeout=1)  # Timeout after 1 second, no need to wait more than that
             if data == 'DONE':
                 print('Process ' + str(job_id) + ': job done, stop here this process.')
+                Profiler.flush()
                 qo.put('DONE')
                 return
+            elif 'collection_parts' in data:
+                print('Process '+str(job_id)+': Start CollectionPartBatch of '+str(len(data['collection_parts']))+' collections ~'+str(total - qi.qsize())+'/'+str(total))
+                collection_part_batch = CollectionPartBatch(configuration, data['collection_parts'])
+                collection_part_batch.sync()
+                Profiler.flush()
             else:
                 if data['collection_part']['db'] == "local" and data['collection_part']['coll'] == 'oplog.rs':
                     print('Process ' + str(job_id) + ': Start long-running job to clone the oplog')
+                    data['collection_part']['bulk_done'] = common_info['bulk_done']
                 else:
                     print('Process '+str(job_id)+': Start CollectionParts ~'+str(total - qi.qsize())+'/'+str(total))
 
                 data['collection_part']['configuration'] = configuration
                 collection_part = Core.create_collection_part(inputs = data['collection_part'])
                 collection_part.sync()
+                Profiler.flush()
 
         except QueueEmpty:
+            Profiler.flush()
             qo.put('DONE')
             return  # Exit when all work is done
         except:
             raise  # Raise all other errors
 
+"""
+    Function (in another process) claiming the jobs of the distributed work queue, shared with the other mongosync
+    instances, until every job is done (by any instance)
+"""
+def claim_collection_parts(qo, job_id, common_info):
+    print('Process '+str(job_id)+': start to claim CollectionParts from the work queue.')
+
+    Configuration.FILEPATH = common_info['configuration_filepath']
+    configuration = Configuration()
+    if common_info['profile']:
+        Profiler.enable(configuration, 'worker-'+str(job_id))
+    RateLimiter.enable(common_info['rate_limiter'])
+    work_queue = WorkQueue(configuration, generation=common_info['generation'])
+    while True:
+        job = work_queue.claim()
+        if job is None:
+            remaining = work_queue.remaining()
+            if remaining == 0:
+                print('Process ' + str(job_id) + ': job done, stop here this process.')
+                Profiler.flush()
+                qo.put('DONE')
+                return
+            # The remaining jobs are claimed by other processes, but their leases might expire
+            time.sleep(min(10, work_queue.lease / 3))
+            continue
+
+        print('Process '+str(job_id)+': Start job '+str(job['_id'])+' of the work queue (attempt '+str(job['attempts'])+').')
+        heartbeat = Heartbeat(work_queue, job)
+        heartbeat.start()
+        data = job['inputs']
+        if 'collection_parts' in data:
+            collection_part_batch = CollectionPartBatch(configuration, data['collection_parts'])
+            collection_part_batch.sync()
+        else:
+            data['collection_part']['configuration'] = configuration
+            collection_part = Core.create_collection_part(inputs = data['collection_part'])
+            collection_part.sync()
+        heartbeat.stop()
+        # If we lost the lease, the job was claimed by another process which will report it as done itself
+        if heartbeat.lost or not work_queue.complete(job):
+            print('Process '+str(job_id)+': lost the lease of the job '+str(job['_id'])+' of the work queue, do not report it as done.')
+        Profiler.flush()
+
 
 class Core:
 
     def __init__(self, configuration):
         self.configuration = configuration
-        self.primary = Mongo(configuration, is_primary=True)
-        self.secondary = Mongo(configuration, is_primary=False)
+        self.primary = MongoFactory.create(configuration, is_primary=True)
+        self.secondaries = [MongoFactory.create(configuration, is_primary=False, host=host) for host in configuration.mongo_hosts_out_of_sync()]
+        self.secondary = self.secondaries[0]
 
     """
         In charge of launching the entire synchronisation of every database. Simple version without any multi-threading.
@@ -55,55 +118,315 @@ class Core:
         print('Prepare sync of the following databases: '+str(', '.join(self.primary.list_databases())))
 
         # Check all CollectionParts we need to create
-        oplog_input = None
+        if self.configuration.mongo_sharded():
+            self.start_sharded_sync()
+        else:
+            oplog_inputs, other_inputs = self.prepare_replica_set_sync()
+            self.run_jobs(oplog_inputs, other_inputs)
+
+        if self.configuration.mongo_sharded():
+            print('The oplogs of the shards are now applied on the targets, the data is consistent once they have caught up.')
+        if self.configuration.internal_oplog_journal_directory() is not None:
+            print('The journaled oplog entries will now be replayed to the targets.')
+        print('End synchronisation of every database, the oplog synchronisation will continue until you stop this script. Afterwards, just remove the database from the maintenance mode.')
+
+    """
+        The chunks are directly read from the shards, based on the chunk list read at the start: a chunk moved by the balancer
+        in the meantime would be read from a shard which does not own it anymore, and its migration to the new shard is not
+        applied from the oplog (the "fromMigrate" entries are skipped). So the balancer is stopped during the clone, and
+        started again once the clone of every CollectionPart is done (the oplogs continue to be applied afterwards).
+    """
+    def start_sharded_sync(self):
+        balancer_enabled = self.primary.balancer_enabled()
+        if balancer_enabled:
+            print('Stop the balancer of the sharded cluster until the end of the clone (wait for its current round).')
+            self.primary.stop_balancer()
+        try:
+            if self.primary.migration_in_progress():
+                raise ValueError('A chunk migration is in progress in the sharded cluster, try again once it is over.')
+            oplog_inputs, other_inputs = self.prepare_sharded_sync()
+            self.run_jobs(oplog_inputs, other_inputs)
+        finally:
+            if balancer_enabled:
+                self.primary.start_balancer()
+                print('The balancer of the sharded cluster is started again.')
+
+    """
+        Incremental synchronisation of the databases already cloned before, without any oplog: the append-only collections
+        only get the documents they are missing, the other ones are entirely copied once again in upsert mode.
+    """
+    def top_up(self):
+        if self.configuration.mongo_sharded():
+            raise ValueError('The top-up is not supported for a sharded cluster.')
+
+        print('Prepare top-up of the following databases: '+str(', '.join(self.primary.list_databases())))
         other_inputs = []
         for db in self.primary.list_databases():
+            if db == 'local': # There is no oplog to follow in this case
+                continue
             for coll in self.primary.list_collections(db):
-                collection = Collection(configuration=self.configuration, db=db, coll=coll)
-                collection_part_inputs = collection.prepare_sync()
+                collection = Collection(configuration=self.configuration, db=db, coll=coll, mongo_primary=self.primary, mongo_secondaries=self.secondaries)
+                for inputs in collection.prepare_top_up():
+                    other_inputs.append({'collection_part': inputs})
 
-                for inputs in collection_part_inputs:
-                    # We need to reserve a long-running thread for the oplog. So, we want to put as the first element of the Queue
-                    data = {'collection_part': inputs}
-                    if db == "local" and coll == "oplog.rs":
-                        oplog_input = data
-                    else:
-                        other_inputs.append(data)
+        other_inputs = self.coalesce_small_collections(other_inputs)
+        self.spread_reads(other_inputs)
+        self.run_jobs([], other_inputs)
+        print('End top-up of every database.')
 
-        if oplog_input is None:
-            raise ValueError("No oplog found...")
+    """
+        Clone every given CollectionPart with multiple processes, and wait for all of them except the oplog ones, which
+        never stop by themselves.
+    """
+    def run_jobs(self, oplog_inputs, other_inputs):
+        # Only this instance clears the local files of a previous run: a worker instance on the same host, with the same
+        # configuration, would otherwise remove the spool segments being written by this one
+        if Configuration.PROFILE:
+            Profiler.clear(self.configuration.internal_profile_directory())
+        if self.configuration.internal_spool_directory() is not None:
+            Spool.clear(self.configuration.internal_spool_directory())
 
+        # In a distributed clone, the other CollectionParts are published in the work queue, and claimed by the processes of
+        # every mongosync instance (this one included)
+        distributed = self.configuration.internal_distributed()
+        generation = None
+        if distributed:
+            work_queue = WorkQueue(self.configuration)
+            generation = work_queue.publish(other_inputs)
+            other_inputs = []
+        self.run_processes(oplog_inputs, other_inputs, distributed, generation)
+
+        # The work queue would stay forever in the internal database of the targets otherwise
+        if distributed and work_queue.remaining() == 0:
+            work_queue.drop()
+
+    """
+        Clone the CollectionParts of the work queue published by another mongosync instance, with multiple processes, until
+        every job of the queue is done. The oplog is handled by the instance which published the work queue.
+        We wait for a generation with remaining jobs, so a worker started before the publication does not stop right away
+        because of the finished queue of a previous run.
+    """
+    def work(self):
+        work_queue = WorkQueue(self.configuration)
+        while work_queue.load_generation() is None or work_queue.remaining() == 0:
+            print('No pending job in the work queue '+work_queue.db+'.'+work_queue.coll+' yet, wait for another instance to publish them.')
+            time.sleep(10)
+        print('Work on the generation '+work_queue.generation+' of the work queue.')
+        self.run_processes([], [], distributed=True, generation=work_queue.generation)
+        print('Every job of the work queue is done.')
+
+    """
+        Start the processes cloning the oplogs and the given CollectionParts (or the ones of the work queue if distributed),
+        and wait for all of them except the oplog ones, which never stop by themselves.
+    """
+    def run_processes(self, oplog_inputs, other_inputs, distributed, generation=None):
         # Fill queues used for the multi-threading
         qi = mp.Queue()
         qo = mp.Queue()
 
-        qi.put(oplog_input)
+        for inputs in oplog_inputs:
+            qi.put(inputs)
         for inputs in other_inputs:
             qi.put(inputs)
 
-        # Starts the Jobs. We need at least 1 thread for the oplog, and another for the other collections
+        # Starts the Jobs. We need at least 1 thread for each oplog, and another for the other collections
         jobs = []
-        jobs_quantity = 1 + int(max(1,self.configuration.internal_threads()))
-        common_info = {'configuration_filepath': Configuration.FILEPATH}
+        jobs_quantity = len(oplog_inputs) + int(max(1,self.configuration.internal_threads()))
+        rate_limiter = RateLimiter(self.configuration.internal_rate_limit_bytes(), self.configuration.internal_rate_limit_docs())
+        bulk_done = mp.Event() # Set once every CollectionPart except the oplog ones is done
+        common_info = {'configuration_filepath': Configuration.FILEPATH, 'profile': Configuration.PROFILE, 'rate_limiter': rate_limiter, 'bulk_done': bulk_done,
+                       'generation': generation}
         for i in range(int(jobs_quantity)):
             qi.put('DONE')
-            job = mp.Process(target=clone_collection_part, args=(qi, qo, i, common_info, ))
+            if distributed and i >= len(oplog_inputs):
+                job = mp.Process(target=claim_collection_parts, args=(qo, i, common_info, ))
+            else:
+                job = mp.Process(target=clone_collection_part, args=(qi, qo, i, common_info, ))
             job.start()
             jobs.append(job)
 
         job_done = 0
-        while job_done < (jobs_quantity - 1): # There is one long-running thread which should never finish by itself.
+        while job_done < (jobs_quantity - len(oplog_inputs)): # There is one long-running thread per oplog which should never finish by itself.
             try:
-                res = qo.get(timeout=3600*24)
+                res = qo.get(timeout=10)
                 if res == 'DONE':
                     job_done += 1
-                    print('Remaining jobs: '+str(jobs_quantity - job_done - 1))
+                    print('Remaining jobs: '+str(jobs_quantity - job_done - len(oplog_inputs)))
             except QueueEmpty: # We cannot put a super-huge time out, so we simply handle the exception
                 pass
             except:
                 raise  # Raise all other errors
 
-        print('End synchronisation of every database, the oplog synchronisation will continue until you stop this script. Afterwards, just remove the database from the maintenance mode.')
+            # Regularly reload the rate limits, as they can be changed in the configuration file during the sync
+            try:
+                configuration = Configuration()
+                rate_limiter.set_rates(configuration.internal_rate_limit_bytes(), configuration.internal_rate_limit_docs())
+            except ValueError as e:
+                print('Invalid configuration file ('+str(e)+'), keep the current rate limits.')
+
+        bulk_done.set()
+
+        if Configuration.PROFILE:
+            Profiler.merge(self.configuration.internal_profile_directory())
+
+    """
+        Prepare every collection of a replica set, and return the inputs for the oplog CollectionPart and the inputs for
+        the other CollectionParts.
+    """
+    def prepare_replica_set_sync(self):
+        oplog_input = None
+        other_inputs = []
+        for db in self.primary.list_databases():
+            for coll in self.primary.list_collections(db):
+                collection = Collection(configuration=self.configuration, db=db, coll=coll, mongo_primary=self.primary, mongo_secondaries=self.secondaries)
+                collection_part_inputs = collection.prepare_sync()
+
+                for inputs in collection_part_inputs:
+                    # We need to reserve a long-running thread for the oplog. So, we want to put as the first element of the Queue
+                    data = {'collection_part': inputs}
+                    if db == "local" and coll == "oplog.rs":
+                        oplog_input = data
+                    else:
+                        other_inputs.append(data)
+
+        if oplog_input is None:
+            raise ValueError("No oplog found...")
+
+        other_inputs = self.coalesce_small_collections(other_inputs)
+
+        # The oplog must always be read from the same member to have a consistent tailing
+        members = self.spread_reads(other_inputs)
+        if len(members) > 0:
+            oplog_input['collection_part']['source_host'] = members[0]
+
+        return [oplog_input], other_inputs
+
+    """
+        Spread the reads over the eligible members of the in-sync replica set, if it is configured. Return the list of
+        members used (empty if the reads are not spread).
+    """
+    def spread_reads(self, other_inputs):
+        if not self.configuration.mongo_read_preference_spread_reads():
+            return []
+        members = self.primary.eligible_members()
+        if len(members) > 0:
+            print('Spread the reads over the following members: '+str(', '.join(members)))
+            for i, data in enumerate(other_inputs):
+                for inputs in data.get('collection_parts', [data.get('collection_part')]):
+                    inputs['source_host'] = members[i % len(members)]
+        return members
+
+    """
+        Prepare every collection of a sharded cluster (the in-sync host is a mongos). The chunks of each sharded collection
+        are used as CollectionParts and directly read from the shard owning them, the unsharded collections are read from
+        the primary shard of their database. One oplog is tailed per shard, and written to the internal database of the
+        targets (as we cannot mix the oplogs of different shards). Those copies are not replayed by the targets themselves,
+        so the entries are applied on the targets by the oplog CollectionParts once every other CollectionPart is done.
+    """
+    def prepare_sharded_sync(self):
+        shards = self.primary.list_shards()
+        print('Sharded cluster with the following shards: '+str(', '.join([shard['_id'] for shard in shards])))
+        shard_hosts = {shard['_id']: shard['host'] for shard in shards}
+
+        # Last entry of the oplog of each shard before reading anything: the copied oplogs must go back at least to it
+        start_ts = {}
+        for shard in shards:
+            window = MongoFactory.create(self.configuration, is_primary=True, host=shard['host']).oplog_window()
+            if window is None:
+                raise ValueError('No oplog found on the shard '+str(shard['_id'])+', the sync is not possible.')
+            start_ts[shard['_id']] = window['last_ts']
+
+        inputs_per_shard = {shard['_id']: [] for shard in shards}
+        for db in self.primary.list_databases():
+            if db in ['admin', 'config', 'local']: # Metadata of the cluster, or not available through a mongos
+                continue
+            for coll in self.primary.list_collections(db):
+                collection = Collection(configuration=self.configuration, db=db, coll=coll, mongo_primary=self.primary, mongo_secondaries=self.secondaries)
+                sharded_collection = self.primary.sharded_collection(db, coll)
+                if sharded_collection is None:
+                    primary_shard = self.primary.database_primary_shard(db)
+                    if primary_shard not in shard_hosts:
+                        print('No primary shard found for the database '+str(db)+', skip the collection '+str(coll)+'.')
+                        continue
+                    for inputs in collection.prepare_sync():
+                        inputs['source_host'] = shard_hosts[primary_shard]
+                        inputs_per_shard[primary_shard].append({'collection_part': inputs})
+                    continue
+
+                collection.check_collection()
+                collection.copy_indexes()
+                chunks = self.primary.list_chunks(sharded_collection)
+                for chunk in chunks:
+                    inputs_per_shard[chunk['shard']].append({'collection_part': {
+                        'db': db,
+                        'coll': coll,
+                        'seed_start': chunk['min'],
+                        'seed_end': chunk['max'],
+                        'total_seeds': len(chunks),
+                        'source_host': shard_hosts[chunk['shard']],
+                        'shard_key': sharded_collection['key']
+                    }})
+
+        # Interleave the CollectionParts of each shard, so every shard is read in parallel
+        other_inputs = []
+        remaining = [self.coalesce_small_collections(inputs) for inputs in inputs_per_shard.values() if len(inputs) > 0]
+        while len(remaining) > 0:
+            for inputs in remaining:
+                other_inputs.append(inputs.pop(0))
+            remaining = [inputs for inputs in remaining if len(inputs) > 0]
+
+        # One oplog per shard
+        oplog_inputs = []
+        for shard in shards:
+            target_coll = 'oplog.' + shard['_id']
+            for mongo_secondary in self.secondaries:
+                if target_coll not in mongo_secondary.list_collections(self.configuration.internal_database()):
+                    mongo_secondary.create_collection(self.configuration.internal_database(), target_coll, capped=True, max_size=self.configuration.mongo_oplog_size() * (1024 ** 3))
+            oplog_inputs.append({'collection_part': {
+                'db': 'local',
+                'coll': 'oplog.rs',
+                'source_host': shard['host'],
+                'target_db': self.configuration.internal_database(),
+                'target_coll': target_coll,
+                'apply_oplog': True,
+                'start_ts': start_ts[shard['_id']]
+            }})
+
+        return oplog_inputs, other_inputs
+
+    """
+        Pack the small collections (only one CollectionPart, and a few MB) into shared jobs, sized by their total number of
+        bytes. Each job is then synced with one set of connections, instead of paying the fixed cost of a CollectionPart
+        for each collection. The other inputs are returned as-is.
+    """
+    def coalesce_small_collections(self, inputs_list):
+        job_size = self.configuration.internal_small_collections_job_size() * (1024 ** 2)
+        if job_size <= 0:
+            return inputs_list
+
+        other_inputs = []
+        batches = []
+        current_batch = []
+        current_size = 0
+        for data in inputs_list:
+            inputs = data['collection_part']
+            size = inputs.get('coll_stats', {}).get('size', job_size)
+            if inputs['total_seeds'] > 2 or 'shard_key' in inputs or size >= job_size:
+                other_inputs.append(data)
+                continue
+
+            if current_size + size > job_size and len(current_batch) > 0:
+                batches.append({'collection_parts': current_batch})
+                current_batch = []
+                current_size = 0
+            current_batch.append(inputs)
+            current_size += size
+        if len(current_batch) > 0:
+            batches.append({'collection_parts': current_batch})
+
+        if len(batches) > 0:
+            print('Coalesce '+str(sum([len(batch['collection_parts']) for batch in batches]))+' small collections into '+str(len(batches))+' jobs.')
+        return other_inputs + batches
 
     """
         Create the appropriate CollectionPart instance
@@ -112,5 +435,7 @@ class Core:
     def create_collection_part(inputs):
         if inputs['db'] == 'local' and inputs['coll'] == 'oplog.rs':
             return OplogCollectionPart(**inputs)
+        elif 'shard_key' in inputs:
+            return ChunkCollectionPart(**inputs)
         else:
             return BasicCollectionPart(**inputs)
@@ -0,0 +1,133 @@
+from src.core.service.MongoFactory import MongoFactory
+from src.core.clone.Collection import Collection
+
+import math
+import random
+import time
+
+class Plan:
+
+    def __init__(self, configuration):
+        self.configuration = configuration
+        self.primary = MongoFactory.create(configuration, is_primary=True)
+        self.secondaries = [MongoFactory.create(configuration, is_primary=False, host=host) for host in configuration.mongo_hosts_out_of_sync()]
+
+    """
+        Discover every collection and plan the seeds like the "start" operation, but without writing anything. We sample
+        the read throughput on a few ranges of the biggest collections to estimate the clone duration, and we compare it
+        to the oplog window of the in-sync node.
+    """
+    def start(self):
+        threads = self.configuration.internal_threads()
+        print('Plan the sync of the following databases: '+str(', '.join(self.primary.list_databases())))
+
+        # Discovery and seed planning
+        collections = []
+        for db in self.primary.list_databases():
+            for coll in self.primary.list_collections(db):
+                if db == "local" and coll == "oplog.rs":
+                    continue
+                collection = Collection(configuration=self.configuration, db=db, coll=coll, mongo_primary=self.primary, mongo_secondaries=self.secondaries)
+                if len(collection.coll_stats) == 0:
+                    continue
+                collections.append({'collection': collection, 'parts': collection.plan_sync(), 'size': collection.coll_stats.get('size', 0)})
+        collections = sorted(collections, key=lambda c: c['size'], reverse=True)
+
+        # Sample the read throughput (bytes/s for one process) on the biggest collections
+        throughput = self.sample_throughput(collections[:self.configuration.internal_plan_sample_collections()])
+        if throughput <= 0:
+            print('Not possible to sample the read throughput (no data?), stop here.')
+            return
+
+        # Estimation per collection. A collection cannot be cloned faster than its number of parts allows.
+        total_size = 0
+        total_duration = 0
+        for c in collections:
+            parallelism = max(1, min(threads, len(c['parts'])))
+            c['duration'] = c['size'] / (throughput * parallelism)
+            total_size += c['size']
+            total_duration = max(total_duration, c['duration'])
+            print(str(c['collection'])+': '+str(int(c['size']/(1024**2)))+'MB, '+str(len(c['parts']))+' parts, ~'+str(Plan.format_duration(c['duration']))+'.')
+        total_duration = max(total_duration, total_size / (throughput * threads))
+        print('Read throughput: ~'+str(int(throughput/(1024**2)))+'MB/s per thread. Total: '+str(int(total_size/(1024**3)))+'GB, ' +
+              'estimated clone duration with '+str(threads)+' threads: ~'+str(Plan.format_duration(total_duration))+' (read side only).')
+
+        self.check_oplog_window(collections, throughput, total_size, total_duration)
+
+    """
+        Read a few random ranges of the given collections, and return the average number of bytes/s read by one process
+    """
+    def sample_throughput(self, collections):
+        sample_bytes = self.configuration.internal_plan_sample_size() * (1024 ** 2)
+        read_bytes = 0
+        read_time = 0
+        for c in collections:
+            collection = c['collection']
+            average_object_size = collection.coll_stats.get('avgObjSize', 0)
+            if average_object_size <= 0:
+                continue
+            limit = int(max(1, sample_bytes / average_object_size))
+            parts = random.sample(c['parts'], min(len(c['parts']), self.configuration.internal_plan_sample_ranges()))
+            for part in parts:
+                query = {}
+                if part['seed_start'] is not None and part['seed_end'] is not None:
+                    query = {'_id': {'$gte': part['seed_start']['_id'], '$lte': part['seed_end']['_id']}}
+                st = time.time()
+                quantity = len(list(collection.mongo_primary.find(collection.db, collection.coll, query=query, limit=limit, sort_field='_id')))
+                read_time += time.time() - st
+                read_bytes += quantity * average_object_size
+                print(str(collection)+' (sample): '+str(quantity)+' docs in '+str(int(1000*(time.time() - st)))+'ms.')
+
+        if read_time <= 0:
+            return 0
+        return read_bytes / read_time
+
+    """
+        Compare the estimated clone duration with the oplog window, and suggest a better configuration if needed.
+    """
+    def check_oplog_window(self, collections, throughput, total_size, total_duration):
+        window = self.primary.oplog_window()
+        if window is None:
+            print('No oplog found on the in-sync node, the sync is not possible.')
+            return
+
+        current_window = window['last_ts'].time - window['first_ts'].time
+        growth_rate = 0
+        full_window = current_window
+        if current_window > 0 and window['size'] > 0:
+            growth_rate = window['size'] / current_window # bytes/s
+            full_window = window['max_size'] / growth_rate
+        print('Oplog: '+str(int(window['size']/(1024**2)))+'/'+str(int(window['max_size']/(1024**2)))+'MB, current window: ~' +
+              str(Plan.format_duration(current_window))+', growth rate: ~'+str(int(growth_rate/1024))+'KB/s, window once full: ~' +
+              str(Plan.format_duration(full_window))+'.')
+
+        # We want to have a security margin, as the writes to the out-of-sync node are not part of the estimate
+        if total_duration <= full_window / 2:
+            print('The estimated clone duration fits in the oplog window.')
+            return
+
+        if full_window <= 0 or throughput <= 0:
+            print('Warning: the oplog window cannot be estimated yet (the oplog covers less than 1 second), check it again later.')
+            return
+
+        threads = self.configuration.internal_threads()
+        print('Warning: the estimated clone duration (~'+str(Plan.format_duration(total_duration))+') is too long compared to the oplog window (~'+str(Plan.format_duration(full_window))+').')
+        suggested_threads = int(math.ceil(total_size / (throughput * full_window / 2)))
+        print('Suggestion: use at least '+str(suggested_threads)+' threads (currently '+str(threads)+').')
+        biggest = collections[0]
+        if len(biggest['parts']) < suggested_threads:
+            print('Suggestion: increase the maximum number of seeds to at least '+str(suggested_threads)+', '+str(biggest['collection'])+' only has '+str(len(biggest['parts']))+' parts.')
+        if growth_rate > 0:
+            print('Suggestion: or increase the oplog size of the in-sync node to at least '+str(int(math.ceil(2 * growth_rate * total_duration / (1024**3))))+'GB.')
+
+    """
+        Human readable duration
+    """
+    @staticmethod
+    def format_duration(seconds):
+        seconds = int(seconds)
+        if seconds >= 3600:
+            return str(seconds // 3600)+'h'+str((seconds % 3600) // 60).zfill(2)
+        if seconds >= 60:
+            return str(seconds // 60)+'min'
+        return str(seconds)+'s'
@@ -1,6 +1,7 @@
 
 import time
 from src.core.clone.CollectionPart import CollectionPart
+from src.core.service.Profiler import Profiler
 
 class BasicCollectionPart(CollectionPart):
 
@@ -20,7 +21,12 @@ class BasicCollectionPart(CollectionPart):
         }
         skip = 0
         if self.previous_id is not None:
-            query['_id']['$gte'] = self.previous_id
+            if self.write_mode == 'upsert':
+                # Exclusive continuation, there is no need to write the last document of the previous section once again
+                del query['_id']['$gte']
+                query['_id']['$gt'] = self.previous_id
+            else:
+                query['_id']['$gte'] = self.previous_id
 
         if self.seed_start['_id'] is None or self.seed_end['_id'] is None:
             del query['_id']['$lte']
@@ -29,7 +35,9 @@ class BasicCollectionPart(CollectionPart):
                 query = {}
                 skip = offset
 
-        objects = list(self.mongo_primary.find(self.db, self.coll, query=query, skip=skip, limit=limit_read, sort_field='_id'))
+        with Profiler.phase('cursor_fetch'):
+            objects = list(self.mongo_primary.find(self.db, self.coll, query=query, skip=skip, limit=limit_read, sort_field='_id', raw=self.fetch_raw()))
+        objects = self.decode_raw(objects)
         read_time = time.time() - st
 
         # Writing the objects to the secondary
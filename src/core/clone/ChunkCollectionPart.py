@@ -0,0 +1,57 @@
+import time
+from src.core.clone.CollectionPart import CollectionPart
+from src.core.service.Profiler import Profiler
+from pymongo.errors import PyMongoError
+
+"""
+    A chunk of a sharded collection, directly read from the shard owning it. The boundaries of a chunk are expressed with
+    the shard key (which is not necessarily the _id), so we iterate on a min/max cursor hinted on the shard key index. A
+    chunk being small, we simply restart the cursor if we lose the connection in the middle of it.
+"""
+class ChunkCollectionPart(CollectionPart):
+    def __init__(self, *args, shard_key=None, **kwargs):
+        CollectionPart.__init__(self, *args, **kwargs)
+
+        if shard_key is None:
+            raise ValueError("A ChunkCollectionPart needs the shard key of the collection!")
+        self.shard_key = shard_key
+        self.cursor = None
+
+    def continue_fetching(self, received_quantity, expected_quantity):
+        return received_quantity >= expected_quantity
+
+    def sync_section(self, offset, limit_read, limit_write):
+        st = time.time()
+        while True:
+            objects = []
+            try:
+                if self.cursor is None:
+                    self.cursor = self.mongo_primary.find_range(self.db, self.coll, self.shard_key, self.seed_start, self.seed_end, skip=offset, raw=self.fetch_raw())
+                with Profiler.phase('cursor_fetch'):
+                    for doc in self.cursor:
+                        objects.append(doc)
+                        if len(objects) >= limit_read:
+                            break
+                break
+            except PyMongoError as e:
+                if time.time() - st >= self.configuration.mongo_access_attempt():
+                    raise
+                print('Problem while iterating on the cursor of '+str(self)+' ('+str(e)+'), restart it from the current offset.')
+                self.cursor = None
+                time.sleep(0.5)
+        objects = self.decode_raw(objects)
+        read_time = time.time() - st
+
+        # Writing the objects to the secondary
+        st = time.time()
+        for i in range(0, len(objects), limit_write):
+            self.insert_subset(objects[i:i + limit_write])
+        write_time = time.time() - st
+
+        return {'quantity': len(objects), 'read_time': read_time, 'write_time': write_time}
+
+    def __str__(self):
+        return 'ChunkCollectionPart:' + self.db + '.' + self.coll+':['+str(self.seed_start)+';'+str(self.seed_end)+']@'+str(self.source_host)
+
+    def __repr__(self):
+        return self.__str__()
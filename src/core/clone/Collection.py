@@ -1,15 +1,25 @@
-from src.core.service.Mongo import Mongo
+from src.core.service.MongoFactory import MongoFactory
 import time
 import pymongo
 from bson.objectid import ObjectId
 
 class Collection:
-    def __init__(self, configuration, db, coll):
+    # Stats of the collection given to the CollectionParts, to avoid a collstats for each of them
+    PART_STATS = ['ns', 'count', 'size', 'avgObjSize', 'storageSize', 'capped']
+
+    """
+        The connections can be given to share them between collections, otherwise new ones are created.
+    """
+    def __init__(self, configuration, db, coll, mongo_primary=None, mongo_secondaries=None):
         self.configuration = configuration
         self.db = db
         self.coll = coll
-        self.mongo_primary = Mongo(configuration, is_primary=True)
-        self.mongo_secondary = Mongo(configuration, is_primary=False)
+        if mongo_primary is None:
+            mongo_primary = MongoFactory.create(configuration, is_primary=True)
+        if mongo_secondaries is None:
+            mongo_secondaries = [MongoFactory.create(configuration, is_primary=False, host=host) for host in configuration.mongo_hosts_out_of_sync()]
+        self.mongo_primary = mongo_primary
+        self.mongo_secondaries = mongo_secondaries
 
         self.coll_stats = self.mongo_primary.collection_stats(db=self.db, coll=self.coll)
         self.previous_id = None
@@ -18,17 +28,74 @@ class Collection:
         In charge of preparing the collection to synchronize, returns the various seeds we should use. 
     """
     def prepare_sync(self):
-        average_object_size = self.coll_stats['avgObjSize']
-        expected_documents  = self.coll_stats['count'] # It can increase but it's not a problem, it's only used for logging
-
         # Drop / Create the destination collection
         self.check_collection()
 
         # Add indexes
         self.copy_indexes()
 
+        return self.plan_sync()
+
+    """
+        Prepare an incremental synchronisation of a collection which was already cloned before (top-up), returns the inputs
+        necessary to create the CollectionParts. For an append-only collection, we only copy the documents after the biggest
+        _id of the targets. Otherwise, every document is copied once again in upsert mode, to verify the full range.
+    """
+    def prepare_top_up(self):
+        self.check_collection()
+        self.copy_indexes()
+
+        start_id = self.top_up_start_id()
+        if start_id is None:
+            print(str(self)+' (top-up): not considered as append-only, verify the full range.')
+            collection_parts = self.plan_sync()
+            for inputs in collection_parts:
+                inputs['write_mode'] = 'upsert'
+            return collection_parts
+
+        print(str(self)+' (top-up): append-only, only copy the documents after '+str(start_id)+'.')
+        return self.plan_sync(start_id=start_id)
+
+    """
+        Biggest _id of the targets, from which the top-up of an append-only collection can start. None if the collection is
+        not append-only, or if we cannot use it (no ObjectId, empty target, different number of documents, ...).
+    """
+    def top_up_start_id(self):
+        append_only = self.configuration.internal_top_up_append_only()
+        declared = self.db+'.'+self.coll in append_only or self.db+'.*' in append_only
+        if not declared and not self.configuration.internal_top_up_detect_append_only():
+            return None
+
+        id_type = self.mongo_primary.id_type(self.db, self.coll)
+        if id_type['is_object_id'] is False:
+            return None
+
+        # With multiple targets, we start from the one which is the most behind
+        start_id = None
+        for mongo_secondary in self.mongo_secondaries:
+            last = list(mongo_secondary.find(db=self.db, coll=self.coll, query={}, skip=0, limit=1, sort_field='_id', sort_order=pymongo.DESCENDING))
+            if len(last) == 0:
+                return None
+            if start_id is None or last[0]['_id'] < start_id:
+                start_id = last[0]['_id']
+
+        # A declared collection is trusted, otherwise every target must have the same documents as the source up to that _id
+        if not declared:
+            source_count = self.mongo_primary.count(self.db, self.coll, {'_id': {'$lte': start_id}})
+            for mongo_secondary in self.mongo_secondaries:
+                target_count = mongo_secondary.count(self.db, self.coll, {'_id': {'$lte': start_id}})
+                if target_count != source_count:
+                    print(str(self)+' (top-up): '+str(source_count)+' docs on the source but '+str(target_count)+' docs on '+str(mongo_secondary.host)+' up to '+str(start_id)+'.')
+                    return None
+        return start_id
+
+    """
+        Returns the list of inputs necessary to create the CollectionParts, without writing anything to the targets. With
+        a start_id, only the documents after it are planned.
+    """
+    def plan_sync(self, start_id=None):
         # Get the various seeds
-        seeds = self.list_seeds()
+        seeds = self.list_seeds(start_id=start_id)
         if len(seeds) == 0:
             print("We should always have at least 2 seeds.")
             raise ValueError("Invalid seed number. Failure.")
@@ -36,13 +103,15 @@ class Collection:
         # Create and return the list of inputs necessary to create CollectionPart
         collection_parts = []
         previous_seed = seeds[0]
+        part_stats = {key: self.coll_stats[key] for key in Collection.PART_STATS if key in self.coll_stats}
         for seed in seeds[1:]:
             collection_parts.append({
                 'db': self.db,
                 'coll': self.coll,
                 'seed_start': previous_seed,
                 'seed_end': seed,
-                'total_seeds': len(seeds)
+                'total_seeds': len(seeds),
+                'coll_stats': part_stats
             })
             previous_seed = seed
         return collection_parts
@@ -52,8 +121,9 @@ class Collection:
     """
         Load the seeds we want to use for the synchronisation. Return a list of tuples, each tuple represent a range,
         the first value is the start of it, the second value, the end of it.
+        With a start_id, the first range starts from it.
     """
-    def list_seeds(self):
+    def list_seeds(self, start_id=None):
         # First, we need to be sure that we have an _id and if that's an objectid, otherwise we cannot use the same technique.
         # The oplog should only be tailed by one thread at a time, so we want to be sure to never create seeds for it.
         id_type = self.mongo_primary.id_type(self.db, self.coll)
@@ -63,11 +133,13 @@ class Collection:
 
         # Number of seeds we would like
         quantity = self.configuration.internal_maximum_seeds()
+        first_id = ObjectId('0'*24) if start_id is None else start_id
         if self.coll_stats['count'] <= 100*quantity: # Arbitrarily, we decide it's useless to use a lot of seeds if we only have a small number of documents
-            return [({'_id':ObjectId('0'*24)},{'_id':ObjectId('f'*24)})]
+            return [{'_id':first_id},{'_id':ObjectId('f'*24)}]
 
         # Get various seeds
-        seeds = self.mongo_primary.section_ids(self.db, self.coll, quantity=quantity)
+        seeds = self.mongo_primary.section_ids(self.db, self.coll, quantity=quantity, start_id=start_id)
+        seeds = [seed for seed in seeds if seed['_id'] > first_id]
 
         # TODO: In the future, if we want to be smart and allow retry of a failed sync, we should take the previous seeds
         # stored in the mongosync database, then make a simple query to see up to where they went
@@ -76,18 +148,30 @@ class Collection:
         seeds = sorted(seeds, key=lambda seed: seed['_id'])
 
         # Always add the first and last seed
-        seeds = [{'_id':ObjectId('0'*24)}] + seeds
+        seeds = [{'_id':first_id}] + seeds
         seeds.append({'_id':ObjectId('f'*24)})
 
         return seeds
 
     """
-        Specific checks before writing to a collection
+        Specific checks before writing to a collection, on every target
     """
     def check_collection(self):
+        for mongo_secondary in self.mongo_secondaries:
+            self.check_target_collection(mongo_secondary)
+
+    """
+        Specific checks before writing to a collection of a given target
+    """
+    def check_target_collection(self, mongo_secondary):
+        # Nothing to check for a basic collection, this is important to avoid listing every collection of the target when
+        # we have thousands of them
+        if self.coll_stats.get('capped', False) is not True:
+            return
+
         # Stats about the optional collection
-        if self.db in self.mongo_secondary.list_databases() and self.coll in self.mongo_secondary.list_collections(self.db):
-            destination_stats = self.mongo_secondary.collection_stats(db=self.db, coll=self.coll)
+        if self.db in mongo_secondary.list_databases() and self.coll in mongo_secondary.list_collections(self.db):
+            destination_stats = mongo_secondary.collection_stats(db=self.db, coll=self.coll)
         else:
             destination_stats = {}
 
@@ -95,7 +179,7 @@ class Collection:
         if len(destination_stats) != 1 and self.db == 'local':
             if self.coll != 'oplog.rs' and False:
                 # Not possible to drop every db
-                self.mongo_secondary.drop(self.db, self.coll)
+                mongo_secondary.drop(self.db, self.coll)
                 self.destination_stats = {}
 
         # Optionally create a capped collection, but we only do that if it didn't exist before
@@ -111,7 +195,7 @@ class Collection:
             if capped_max == -1:
                 capped_max = None
 
-            self.mongo_secondary.create_collection(self.db, self.coll, capped=True, max=capped_max, max_size=capped_max_size)
+            mongo_secondary.create_collection(self.db, self.coll, capped=True, max=capped_max, max_size=capped_max_size)
 
     """
         It is better to copy indexes directly, before copying the data. That way we directly have the TTL working, but we also
@@ -129,7 +213,8 @@ class Collection:
             options['name'] = name
             del index['key']
 
-            self.mongo_secondary.create_index(self.db, self.coll, options)
+            for mongo_secondary in self.mongo_secondaries:
+                mongo_secondary.create_index(self.db, self.coll, dict(options))
 
 
     def __str__(self):
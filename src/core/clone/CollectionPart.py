@@ -1,14 +1,30 @@
 
 import time
-from src.core.service.Mongo import Mongo
+from bson import decode_all
+from src.core.service.MongoFactory import MongoFactory
+from src.core.clone.TargetWriter import TargetWriter
+from src.core.clone.Spool import Spool
+from src.core.service.RateLimiter import RateLimiter
+from src.core.service.Profiler import Profiler
 
 class CollectionPart:
+    # Field used to follow the progress of the writes on each target
+    CHECKPOINT_FIELD = '_id'
+    # Indicates if the documents can go through the local disk spool (if it is enabled)
+    SPOOL = True
+    # Indicates if the reads are throttled by the shared rate limiter (if it is enabled)
+    RATE_LIMITED = True
 
     """
         Seeds can be None if there is no {"_id": ObjectId()} in the document database, in that case there will be only one
-        thread in charge of copying the database
+        thread in charge of copying the database.
+        The source_host is the member of the in-sync replica set we should read from. If None, we use the read preference.
+        The target_db and target_coll are the namespace to write to on the targets, by default the same as the source one.
+        The write_mode is "insert" or "upsert", by default the one from the configuration.
+        The stats of the collection and the connections can be given to share them between multiple CollectionParts.
     """
-    def __init__(self, configuration, db, coll, seed_start=None, seed_end=None, total_seeds=1):
+    def __init__(self, configuration, db, coll, seed_start=None, seed_end=None, total_seeds=1, source_host=None, target_db=None, target_coll=None, write_mode=None,
+                 coll_stats=None, mongo_primary=None, mongo_secondaries=None):
         self.configuration = configuration
         self.db = db
         self.coll = coll
@@ -18,11 +34,28 @@ class CollectionPart:
         self.seed_start = seed_start
         self.seed_end = seed_end
         self.total_seeds = total_seeds # Total number of seeds, which can be seen as the number of instances of CollectionPart
-        self.mongo_primary = Mongo(configuration, is_primary=True)
-        self.mongo_secondary = Mongo(configuration, is_primary=False)
-
-        self.coll_stats = self.mongo_primary.collection_stats(db=self.db, coll=self.coll)
+        self.source_host = source_host
+        if mongo_primary is None:
+            mongo_primary = MongoFactory.create(configuration, is_primary=True, host=source_host)
+        if mongo_secondaries is None:
+            mongo_secondaries = [MongoFactory.create(configuration, is_primary=False, host=host) for host in configuration.mongo_hosts_out_of_sync()]
+        self.mongo_primary = mongo_primary
+        self.mongo_secondaries = mongo_secondaries
+        self.mongo_secondary = self.mongo_secondaries[0]
+        self.write_mode = write_mode if write_mode is not None else configuration.internal_write_mode()
+        self.target_db = target_db if target_db is not None else db
+        self.target_coll = target_coll if target_coll is not None else coll
+        self.writers = [TargetWriter(mongo, self.target_db, self.target_coll, self.CHECKPOINT_FIELD, configuration.internal_target_buffer(), self.write_mode) for mongo in self.mongo_secondaries]
+        if len(self.writers) >= 2:
+            # Only use threads if we need to write to multiple targets at the same time
+            for writer in self.writers:
+                writer.start()
+
+        if coll_stats is None:
+            coll_stats = self.mongo_primary.collection_stats(db=self.db, coll=self.coll)
+        self.coll_stats = coll_stats
         self.previous_id = None
+        self.spool = None
 
     """
         Indicates if we should continue pulling data from the collection or not. For a BasicCollectionPart this will be easy
@@ -31,24 +64,57 @@ class CollectionPart:
         raise ValueError('To implement in the children.')
 
     """
-        Try to insert a bunch of documents, while avoiding crashes if the total size is bigger than 16MB
+        Indicates if the documents must be fetched without being decoded (RawBSONDocument): to write them as they are to the
+        spool, or to decode them ourselves while profiling (see decode_raw)
+    """
+    def fetch_raw(self):
+        return self.spool is not None or Profiler.enabled()
+
+    """
+        While profiling (and without spool), the documents are fetched raw and decoded here, so the decoding is measured
+        on its own: pymongo decodes them within the server round trips otherwise.
+    """
+    def decode_raw(self, objects):
+        if self.spool is not None or not Profiler.enabled() or len(objects) == 0:
+            return objects
+        with Profiler.phase('decode'):
+            return decode_all(b''.join([doc.raw for doc in objects]))
+
+    """
+        Insert a bunch of documents in every target, or in the local disk spool if it is enabled (the documents will then
+        be written to the targets by the spool).
     """
     def insert_subset(self, documents):
-        try:
-            self.mongo_secondary.insert_many(self.db, self.coll, documents)
-        except Exception as e:
-            print('Exception while trying to insert ' + str(len(documents)) + ' documents in ' + str(
-                    self) + ' (' + str(e) + '). Try once again, but one document after another.')
-            # Maybe we exceeded the 16MB, so better insert every document separately
-            for doc in documents:
-                self.mongo_secondary.insert_many(self.db, self.coll, [doc])
+        if self.spool is not None:
+            self.spool.append(documents)
+        else:
+            self.write_to_targets(documents)
+
+    """
+        Write a bunch of documents to every target. With multiple targets, the documents are buffered for each of them and
+        written concurrently, so we only wait if one of the targets has a full buffer.
+    """
+    def write_to_targets(self, documents):
+        if len(self.writers) == 1:
+            self.writers[0].write(documents)
+        else:
+            for writer in self.writers:
+                writer.put(documents)
+
+    """
+        Progress of each target, only useful for the logs if we have multiple targets
+    """
+    def targets_log(self):
+        if len(self.writers) == 1:
+            return ''
+        return ' Targets: '+', '.join([str(writer.mongo.host)+' '+str(writer.quantity)+' docs (checkpoint: '+str(writer.checkpoint)+')' for writer in self.writers])+'.'
 
     """
         In charge of syncing the entire part of the collection assigned to it, so every document between two given
         seeds. The collection must be initially created by the Collection class, this is not the job of this class.
     """
     def sync(self):
-        average_object_size = self.coll_stats['avgObjSize']
+        average_object_size = max(1, self.coll_stats.get('avgObjSize', 1)) # Not given for an empty collection
         expected_documents  = int(max(1,self.coll_stats['count'] / self.total_seeds)) # It can increase but it's not a problem, it's only used for logging
 
         # Write limit is 16MB, so we put a security factor by only using ~12 MB
@@ -56,6 +122,9 @@ class CollectionPart:
         # For the read-limit, we can arbitrarily takes up to 16 MB * 10, to avoid using too much RAM.
         limit_read = int(limit_write * 10)
 
+        if self.SPOOL and self.configuration.internal_spool_directory() is not None:
+            self.spool = Spool(self.configuration, str(self), self.write_to_targets, limit_write)
+
         # Raw estimation of the data size for the current collection part
         storage_size_part = self.coll_stats['storageSize']/((1024**3) * self.total_seeds)
 
@@ -67,16 +136,25 @@ class CollectionPart:
         i = 0
         print(str(self)+' (start-sync): ~'+str(expected_documents)+' docs, ~'+str(int(storage_size_part))+'GB.')
         while objects_in_it:
-            raw_stats = self.sync_section(offset, limit_read, limit_write)
+            # With a rate limit, we read smaller sections (~1 second of budget at most), we wait until the budget is not
+            # exceeded anymore before reading, and we only charge the documents actually read afterwards
+            section_limit_read = limit_read
+            if self.RATE_LIMITED:
+                section_limit_read = RateLimiter.read_limit(limit_read, average_object_size)
+                RateLimiter.acquire(0, 0)
+
+            raw_stats = self.sync_section(offset, section_limit_read, limit_write)
+            if self.RATE_LIMITED:
+                RateLimiter.acquire(raw_stats['quantity'] * average_object_size, raw_stats['quantity'])
             offset += raw_stats['quantity']
             read_time += raw_stats['read_time']
             write_time += raw_stats['write_time']
 
-            objects_in_it = self.continue_fetching(raw_stats['quantity'], limit_read)
+            objects_in_it = self.continue_fetching(raw_stats['quantity'], section_limit_read)
 
             i += 1
             if i % 50 == 0 or True:
-                if offset >= expected_documents:
+                if offset >= expected_documents and objects_in_it:
                     # To have better logs, we check the remaining entries
                     self.coll_stats = self.mongo_primary.collection_stats(db=self.db, coll=self.coll)
                     expected_documents = int(max(1,self.coll_stats['count'] / self.total_seeds))
@@ -90,7 +168,15 @@ class CollectionPart:
                     expected_remaining_time = int((expected_documents - offset) / (average_speed * 60)) # In minutes
 
                 time_log = 'Read time: '+str(int(100*read_time/dt))+'%, write time: '+str(int(100*write_time/dt))+'%'
-                print(str(self)+' (syncing): '+str(offset)+'/'+str(expected_documents)+' docs ('+str(ratio)+'%, '+str(int(average_speed))+' docs/s). Remaining time: ~'+str(expected_remaining_time)+' minutes. '+time_log)
+                print(str(self)+' (syncing): '+str(offset)+'/'+str(expected_documents)+' docs ('+str(ratio)+'%, '+str(int(average_speed))+' docs/s). Remaining time: ~'+str(expected_remaining_time)+' minutes. '+time_log+self.targets_log())
+
+        # Wait for the spool and the slowest target before saying that we are done
+        if self.spool is not None:
+            print(str(self)+' (end-read): '+str(offset)+' docs read in '+str(int(time.time() - st))+'s, wait for the spool to be written.')
+            self.spool.finish()
+            self.spool = None
+        for writer in self.writers:
+            writer.stop()
 
         dt = time.time() - st
         print(str(self)+' (end-sync): '+str(offset)+' docs, '+str(int(storage_size_part))+'GB. Time spent: '+str(int(dt))+'s.')
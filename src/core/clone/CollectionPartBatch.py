@@ -0,0 +1,43 @@
+import time
+from src.core.service.MongoFactory import MongoFactory
+from src.core.clone.BasicCollectionPart import BasicCollectionPart
+
+"""
+    A job made of multiple small collections. Each of them is synced as a BasicCollectionPart, but they all share the
+    same connections, and they use the stats computed while planning the sync. With thousands of tiny collections, this
+    fixed overhead would otherwise be bigger than the sync itself.
+"""
+class CollectionPartBatch:
+    def __init__(self, configuration, collection_parts):
+        self.configuration = configuration
+        self.collection_parts = collection_parts
+
+        # Every CollectionPart of the batch is read from the same member
+        source_host = collection_parts[0].get('source_host', None)
+        self.mongo_primary = MongoFactory.create(configuration, is_primary=True, host=source_host)
+        self.mongo_secondaries = [MongoFactory.create(configuration, is_primary=False, host=host) for host in configuration.mongo_hosts_out_of_sync()]
+
+    """
+        Sync every CollectionPart of the batch, one after another
+    """
+    def sync(self):
+        st = time.time()
+        quantity = 0
+        read_time = 0
+        write_time = 0
+        for inputs in self.collection_parts:
+            collection_part = BasicCollectionPart(configuration=self.configuration, mongo_primary=self.mongo_primary, mongo_secondaries=self.mongo_secondaries, **inputs)
+            stats = collection_part.sync()
+            quantity += stats['quantity']
+            read_time += stats['read_time']
+            write_time += stats['write_time']
+
+        dt = time.time() - st
+        print(str(self)+' (end-sync): '+str(quantity)+' docs. Time spent: '+str(int(dt))+'s.')
+        return {'quantity': quantity, 'read_time': read_time, 'write_time': write_time}
+
+    def __str__(self):
+        return 'CollectionPartBatch:'+str(len(self.collection_parts))+' collections'
+
+    def __repr__(self):
+        return self.__str__()
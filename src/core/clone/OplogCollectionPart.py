@@ -1,18 +1,211 @@
 
 import time
 from src.core.clone.CollectionPart import CollectionPart
+from src.core.clone.OplogJournal import OplogJournal
+from src.core.service.MongoFactory import MongoFactory
+from src.core.service.Profiler import Profiler
+from src.core.service.RateLimiter import RateLimiter
+from bson.timestamp import Timestamp
+from pymongo.errors import PyMongoError
+import multiprocessing as mp
+from queue import Empty as QueueEmpty
 import pymongo
 
+"""
+    Function (in another process) fetching every oplog entry in ]start_ts; end_ts] and sending them by batches through
+    the given queue. The queue is bounded, so a process cannot go too far ahead of the writes.
+"""
+def fetch_oplog_range(qo, configuration, source_host, start_ts, end_ts, limit_write):
+    # The process is forked from a worker which might run other threads (TargetWriter, Profiler sampling), so the inherited
+    # Profiler could have its lock held forever. The oplog is never rate limited either.
+    Profiler.CURRENT = None
+    RateLimiter.CURRENT = None
+    mongo = MongoFactory.create(configuration, is_primary=True, host=source_host)
+    last_ts = start_ts
+    st = time.time()
+    while True:
+        batch = []
+        try:
+            for doc in mongo.find_oplog_range(last_ts, end_ts):
+                batch.append(doc)
+                if len(batch) >= limit_write:
+                    qo.put(batch)
+                    last_ts = batch[-1]['ts']
+                    batch = []
+            if len(batch) >= 1:
+                qo.put(batch)
+            qo.put('DONE')
+            return
+        except PyMongoError as e:
+            if time.time() - st >= configuration.mongo_access_attempt():
+                raise
+            # The documents of the current batch were not sent, we fetch them again
+            print('Problem while fetching the oplog range ]'+str(last_ts)+';'+str(end_ts)+'] ('+str(e)+'), try again.')
+            time.sleep(0.5)
+
 """
     The oplog collection is a bit different than the others as there is no _id, and we want 
 """
 class OplogCollectionPart(CollectionPart):
-    def __init__(self, *args, **kwargs):
+    CHECKPOINT_FIELD = 'ts'
+    SPOOL = False
+    # The oplog must never be slowed down, otherwise it could go out of the oplog window of the source
+    RATE_LIMITED = False
+
+    """
+        The bulk_done event is set once the clone of the other collections is done. Until then, the oplog entries are
+        written to the local journal (if it is enabled), and replayed to the targets afterwards.
+        With apply_oplog, the entries are not only copied to the targets, but also applied on them once the clone of the
+        other collections is done. This is needed when the copied oplog is not replayed by the targets themselves (the
+        oplog of a shard, copied to the internal database). The start_ts is the last entry of the source oplog before the
+        start of the clone: the copied oplog must go back at least to it, otherwise some entries were lost.
+    """
+    def __init__(self, *args, bulk_done=None, apply_oplog=False, start_ts=None, **kwargs):
+        # The oplog entries do not necessarily have an _id, and we never want to replace them
+        kwargs['write_mode'] = 'insert'
         CollectionPart.__init__(self, *args, **kwargs)
 
         if self.seed_start['_id'] is not None or self.seed_end['_id'] is not None:
             raise ValueError("There should be only one OplogCollectionPart!")
 
+        self.bulk_done = bulk_done
+        self.apply_oplog = apply_oplog
+        self.start_ts = start_ts
+        self.applied_backlog = False
+        self.journal = None
+        if bulk_done is not None and self.configuration.internal_oplog_journal_directory() is not None:
+            self.journal = OplogJournal(self.configuration, str(self)+':'+str(self.source_host))
+
+    """
+        Before tailing the oplog with a single cursor, we catch up with the backlog (if it is too big) by fetching
+        multiple ranges of "ts" in parallel. The ranges are still written in order, and we directly continue from the last
+        written entry with the tailable cursor afterwards.
+    """
+    def sync(self):
+        self.catch_up()
+        return CollectionPart.sync(self)
+
+    """
+        Parallel fetching of the backlog of the oplog, until we are close enough to the last entry
+    """
+    def catch_up(self):
+        processes = self.configuration.internal_oplog_catchup_processes()
+        threshold = self.configuration.internal_oplog_catchup_threshold()
+        limit_write = int(12 * (1024 ** 2) / max(1, self.coll_stats.get('avgObjSize', 1)))
+        while processes >= 2:
+            window = self.mongo_primary.oplog_window()
+            if window is None:
+                return
+            start_ts = self.previous_id if self.previous_id is not None else window['first_ts']
+            end_ts = window['last_ts']
+            backlog = end_ts.time - start_ts.time
+            if backlog < threshold:
+                return
+
+            # Split the backlog in ranges ]start; end] of the same duration
+            print(str(self)+' (catch-up): ~'+str(int(backlog/60))+' minutes of backlog, fetch them with '+str(processes)+' processes.')
+            step = backlog / processes
+            boundaries = [start_ts] + [Timestamp(int(start_ts.time + i * step), 0) for i in range(1, processes)] + [end_ts]
+            st = time.time()
+            jobs = []
+            for i in range(processes):
+                qo = mp.Queue(maxsize=self.configuration.internal_target_buffer())
+                job = mp.Process(target=fetch_oplog_range, args=(qo, self.configuration, self.source_host, boundaries[i], boundaries[i + 1], limit_write, ))
+                job.start()
+                jobs.append((job, qo))
+
+            # The ranges are written in order, the next processes are blocked by their bounded queues in the meantime
+            n = 0
+            try:
+                for job, qo in jobs:
+                    while True:
+                        try:
+                            batch = qo.get(timeout=1)
+                        except QueueEmpty:
+                            if not job.is_alive():
+                                raise ValueError('Process in charge of an oplog range stopped unexpectedly, stop here.')
+                            continue
+                        if batch == 'DONE':
+                            break
+                        self.insert_subset(batch)
+                        self.previous_id = batch[-1]['ts']
+                        n += len(batch)
+                    job.join()
+                    if job.exitcode != 0:
+                        raise ValueError('Problem while fetching a range of the oplog during the catch-up, stop here.')
+            finally:
+                # In case of error, the other processes might be blocked by their bounded queues
+                for job, qo in jobs:
+                    if job.is_alive():
+                        job.terminate()
+                    job.join()
+
+            dt = time.time() - st
+            print(str(self)+' (catch-up): '+str(n)+' entries in '+str(int(dt))+'s, now at '+str(self.previous_id)+'.')
+
+    """
+        Write the oplog entries to the local journal while the other collections are cloned. Once they are done, the journal
+        is replayed to the targets by a thread, while we continue to append the new entries to it (so we continue to read
+        the oplog of the source). Once the replay has caught up, we directly write the next entries to the targets.
+    """
+    def insert_subset(self, documents):
+        if self.journal is not None:
+            self.journal.append(documents)
+            if not self.bulk_done.is_set():
+                return
+
+            if not self.journal.replaying():
+                print(str(self)+' (journal): clone of the other collections done, replay the '+str(self.journal.quantity)+' journaled entries ('+str(int(self.journal.compressed_size/(1024**2)))+'MB compressed).')
+                self.journal_st = time.time()
+                self.journal.start_replay(self.write_to_targets)
+            if self.journal.pending() > 0:
+                return
+
+            # Only the current segment remains, we wait for it to be replayed
+            self.journal.finish()
+            print(str(self)+' (journal): '+str(self.journal.replayed)+' entries replayed in '+str(int(time.time() - self.journal_st))+'s, now directly write the oplog entries.')
+            self.journal = None
+            return
+        CollectionPart.insert_subset(self, documents)
+
+    """
+        Copy the oplog entries to the targets, and apply them if needed
+    """
+    def write_to_targets(self, documents):
+        CollectionPart.write_to_targets(self, documents)
+        if self.apply_oplog and self.bulk_done is not None and self.bulk_done.is_set() and len(documents) >= 1:
+            self.apply_entries(documents)
+
+    """
+        Apply the oplog entries on every target. The first time, we start with the entries copied to the targets before the
+        end of the clone of the other collections. They are stored in a capped collection, so we check that the oldest
+        ones were not removed in the meantime.
+    """
+    def apply_entries(self, documents):
+        if not self.applied_backlog:
+            for writer in self.writers:
+                writer.flush()
+            for mongo in self.mongo_secondaries:
+                first = list(mongo.find(self.target_db, self.target_coll, query={}, limit=1, sort_field=None))
+                if self.start_ts is not None and (len(first) == 0 or first[0]['ts'] > self.start_ts):
+                    raise ValueError(str(self)+' (apply): the copied oplog on '+str(mongo.host)+' starts after the start of the clone ('+str(self.start_ts)+'), ' +
+                                     'some entries were lost (increase mongo.oplog_size_GB, or the oplog of the source is too small). The targets are not consistent, stop here.')
+                st = time.time()
+                n = 0
+                backlog = []
+                query = {'ts': {'$lt': documents[0]['ts']}}
+                for entry in mongo.find(self.target_db, self.target_coll, query=query, sort_field=None):
+                    backlog.append(entry)
+                    if len(backlog) >= 1000:
+                        n += mongo.apply_oplog(backlog)
+                        backlog = []
+                n += mongo.apply_oplog(backlog)
+                print(str(self)+' (apply): clone of the other collections done, '+str(n)+' copied oplog entries applied on '+str(mongo.host)+' in '+str(int(time.time() - st))+'s.')
+            self.applied_backlog = True
+
+        for mongo in self.mongo_secondaries:
+            mongo.apply_oplog(documents)
+
     def continue_fetching(self, received_quantity, expected_quantity):
         # There is no end to the fetching phase of the oplog. The only way to stop it, it's when the user manually ctrl+c
         # the process to remove it from maintenance.
@@ -25,7 +218,7 @@ class OplogCollectionPart(CollectionPart):
         st = time.time()
         query = {}
         if self.previous_id is not None: # previous_id is the "ts" field in this case.
-            query['ts']['$gt'] = self.previous_id
+            query['ts'] = {'$gt': self.previous_id}
 
         cursor = self.mongo_primary.find_oplog(query=query, skip=0, limit=limit_read)
         read_time = time.time() - st
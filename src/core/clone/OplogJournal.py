@@ -0,0 +1,147 @@
+import hashlib
+import os
+import threading
+import time
+import zlib
+from bson import BSON
+from bson.raw_bson import RawBSONDocument
+
+"""
+    Local journal of the oplog entries, written while the other collections are cloned, so the clone is not bounded by the
+    oplog window of the source anymore (only by the local disk). Every batch is compressed and appended to the current
+    segment file as a block (4 bytes for the length of the compressed block, then the block itself). Once the clone of the
+    other collections is done, a thread replays the sealed segments in order to the targets and deletes them, while the
+    new entries are still appended to the journal. So the oplog of the source is still read during the replay.
+"""
+class OplogJournal:
+    def __init__(self, configuration, name):
+        self.directory = configuration.internal_oplog_journal_directory()
+        self.segment_size = configuration.internal_oplog_journal_segment_size() * (1024 ** 2)
+        self.compression_level = configuration.internal_oplog_journal_compression_level()
+        self.name = hashlib.md5(name.encode('utf-8')).hexdigest()[:16]
+        os.makedirs(self.directory, exist_ok=True)
+
+        # The oplog is fetched again from its beginning at each run, so the segments of a previous run are outdated
+        for filename in os.listdir(self.directory):
+            if filename.startswith(self.name + '.') and (filename.endswith('.journal') or filename.endswith('.journal.part')):
+                print('Remove the outdated oplog journal segment '+str(filename)+'.')
+                os.remove(os.path.join(self.directory, filename))
+
+        self.index = 0
+        self.current = None
+        self.current_size = 0
+        self.quantity = 0
+        self.compressed_size = 0
+        self.replayed = 0
+        self.thread = None
+        self.finished = False
+        self.error = None
+
+    """
+        Append a batch of oplog entries to the current segment
+    """
+    def append(self, documents):
+        self.raise_error()
+        if self.current is None:
+            self.current = open(self.segment_path(self.index) + '.part', 'ab')
+            self.current_size = 0
+        data = b''.join([doc.raw if isinstance(doc, RawBSONDocument) else BSON.encode(doc) for doc in documents])
+        block = zlib.compress(data, self.compression_level)
+        self.current.write(len(block).to_bytes(4, 'little') + block)
+        self.current_size += len(data)
+        self.quantity += len(documents)
+        self.compressed_size += len(block) + 4
+
+        if self.current_size >= self.segment_size:
+            self.seal()
+
+    """
+        Seal the current segment, it can now be replayed
+    """
+    def seal(self):
+        if self.current is None:
+            return
+        self.current.close()
+        os.rename(self.segment_path(self.index) + '.part', self.segment_path(self.index))
+        self.current = None
+        self.index += 1
+
+    """
+        Start the thread replaying the sealed segments to the given sink, in order
+    """
+    def start_replay(self, sink):
+        self.sink = sink
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    """
+        Indicates if the replay thread is started
+    """
+    def replaying(self):
+        return self.thread is not None
+
+    """
+        Number of sealed segments not replayed yet
+    """
+    def pending(self):
+        self.raise_error()
+        return len(self.segments())
+
+    """
+        Seal the last segment, and wait for every segment to be replayed. The journal must not be used afterwards.
+    """
+    def finish(self):
+        self.seal()
+        self.finished = True
+        self.thread.join()
+        self.raise_error()
+
+    """
+        Main loop of the replay thread
+    """
+    def run(self):
+        try:
+            while True:
+                segments = self.segments()
+                if len(segments) == 0:
+                    if self.finished:
+                        return
+                    time.sleep(0.1)
+                    continue
+                self.replay_segment(os.path.join(self.directory, segments[0]))
+        except Exception as e:
+            self.error = e
+
+    """
+        Write every entry of a segment to the sink, then delete it
+    """
+    def replay_segment(self, filepath):
+        with open(filepath, 'rb') as f:
+            while True:
+                header = f.read(4)
+                if len(header) < 4:
+                    break
+                block = f.read(int.from_bytes(header, 'little'))
+                data = zlib.decompress(block)
+                documents = []
+                position = 0
+                while position < len(data):
+                    length = int.from_bytes(data[position:position + 4], 'little')
+                    documents.append(RawBSONDocument(data[position:position + length]))
+                    position += length
+                self.sink(documents)
+                self.replayed += len(documents)
+        os.remove(filepath)
+
+    """
+        Sealed segments of the current journal, in order
+    """
+    def segments(self):
+        return sorted([filename for filename in os.listdir(self.directory) if filename.startswith(self.name + '.') and filename.endswith('.journal')])
+
+    def segment_path(self, index):
+        return os.path.join(self.directory, self.name + '.' + str(index).zfill(8) + '.journal')
+
+    def raise_error(self):
+        if self.error is not None:
+            raise ValueError('Problem while replaying the oplog journal '+str(self.name)+': '+str(self.error))
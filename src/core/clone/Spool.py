@@ -0,0 +1,153 @@
+import hashlib
+import mmap
+import os
+import threading
+import time
+from bson import BSON
+from bson.raw_bson import RawBSONDocument
+
+"""
+    Optional stage between the reads and the writes of a CollectionPart, to read the in-sync node at full speed even if the
+    out-of-sync node is slow to write. Every batch read is appended as raw BSON to a segment file on the local disk, and a
+    thread drains the sealed segments (with memory-mapped reads) to the targets. A segment is deleted once it is fully
+    written. The seeds of the CollectionParts change at each run, so the segments of a previous run cannot be matched with
+    the new CollectionParts: they are removed when a run starts (see clear()). The total size of the spool directory is
+    capped, the reads wait for the writes if we reach it.
+"""
+class Spool:
+    def __init__(self, configuration, name, sink, limit_write):
+        self.configuration = configuration
+        self.directory = configuration.internal_spool_directory()
+        self.max_size = configuration.internal_spool_max_size() * (1024 ** 3)
+        self.segment_size = configuration.internal_spool_segment_size() * (1024 ** 2)
+        self.name = hashlib.md5(name.encode('utf-8')).hexdigest()[:16]
+        self.sink = sink
+        self.limit_write = limit_write
+        os.makedirs(self.directory, exist_ok=True)
+
+        self.index = 0
+        self.current = None
+        self.current_size = 0
+        self.finished = False
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    """
+        Remove the segments of a previous run from the spool directory, before starting any CollectionPart. Otherwise they
+        would never be written nor deleted, and they would count in the maximum size of the directory.
+    """
+    @staticmethod
+    def clear(directory):
+        if not os.path.isdir(directory):
+            return
+        removed = 0
+        for filename in os.listdir(directory):
+            if filename.endswith('.bson') or filename.endswith('.bson.part'):
+                os.remove(os.path.join(directory, filename))
+                removed += 1
+        if removed > 0:
+            print('Removed '+str(removed)+' segments of a previous run from the spool directory '+str(directory)+'.')
+
+    """
+        Append a batch of documents to the current segment. Wait if the spool directory is full.
+    """
+    def append(self, documents):
+        self.raise_error()
+        while self.directory_size() >= self.max_size and len(self.sealed_segments()) > 0:
+            time.sleep(0.1)
+            self.raise_error()
+
+        if self.current is None:
+            self.current = open(self.segment_path(self.index) + '.part', 'ab')
+            self.current_size = 0
+        data = b''.join([doc.raw if isinstance(doc, RawBSONDocument) else BSON.encode(doc) for doc in documents])
+        self.current.write(data)
+        self.current_size += len(data)
+
+        if self.current_size >= self.segment_size:
+            self.seal()
+
+    """
+        Seal the current segment, it can now be written to the targets
+    """
+    def seal(self):
+        if self.current is None:
+            return
+        self.current.close()
+        os.rename(self.segment_path(self.index) + '.part', self.segment_path(self.index))
+        self.current = None
+        self.index += 1
+
+    """
+        Seal the last segment and wait for every segment to be written
+    """
+    def finish(self):
+        self.seal()
+        self.finished = True
+        self.thread.join()
+        self.raise_error()
+
+    """
+        Main loop of the thread, draining the sealed segments in order
+    """
+    def run(self):
+        try:
+            while True:
+                sealed = self.sealed_segments()
+                if len(sealed) == 0:
+                    if self.finished:
+                        return
+                    time.sleep(0.1)
+                    continue
+                self.drain(os.path.join(self.directory, sealed[0]))
+        except Exception as e:
+            self.error = e
+
+    """
+        Write every document of a segment to the targets, then delete it
+    """
+    def drain(self, filepath):
+        if os.path.getsize(filepath) > 0:
+            with open(filepath, 'rb') as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    position = 0
+                    documents = []
+                    while position + 4 <= len(mm):
+                        length = int.from_bytes(mm[position:position + 4], 'little')
+                        if position + length > len(mm):
+                            print('Truncated document at the end of the spool segment '+str(filepath)+', ignore it.')
+                            break
+                        documents.append(RawBSONDocument(mm[position:position + length]))
+                        position += length
+                        if len(documents) >= self.limit_write:
+                            self.sink(documents)
+                            documents = []
+                    if len(documents) >= 1:
+                        self.sink(documents)
+        os.remove(filepath)
+
+    """
+        Sealed segments of the current spool, in order
+    """
+    def sealed_segments(self):
+        return sorted([filename for filename in os.listdir(self.directory) if filename.startswith(self.name + '.') and filename.endswith('.bson')])
+
+    """
+        Total size of the spool directory (for every CollectionPart of every process)
+    """
+    def directory_size(self):
+        size = 0
+        for entry in os.scandir(self.directory):
+            try:
+                size += entry.stat().st_size
+            except FileNotFoundError: # Deleted in the meantime
+                pass
+        return size
+
+    def segment_path(self, index):
+        return os.path.join(self.directory, self.name + '.' + str(index).zfill(8) + '.bson')
+
+    def raise_error(self):
+        if self.error is not None:
+            raise ValueError('Problem while writing the spool '+str(self.name)+': '+str(self.error))
@@ -0,0 +1,114 @@
+import queue
+import threading
+import time
+
+"""
+    In charge of writing the documents of a CollectionPart to one target (out-of-sync node). When we have multiple targets,
+    every TargetWriter runs in its own thread with a bounded buffer of batches: a slow target does not stall the others
+    as long as it is not late by more than the buffer size.
+"""
+class TargetWriter:
+    def __init__(self, mongo, db, coll, checkpoint_field, buffer_size, write_mode='insert'):
+        self.mongo = mongo
+        self.db = db
+        self.coll = coll
+        self.checkpoint_field = checkpoint_field
+        self.write_mode = write_mode
+        self.queue = queue.Queue(maxsize=int(max(1, buffer_size)))
+        self.thread = None
+        self.error = None
+
+        # Progress of the current target
+        self.quantity = 0
+        self.write_time = 0
+        self.checkpoint = None
+
+    """
+        Start the thread in charge of the asynchronous writes. Only needed if we want to use "put"
+    """
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    """
+        Synchronously write a batch of documents, while avoiding crashes if the total size is bigger than 16MB
+    """
+    def write(self, documents):
+        st = time.time()
+        try:
+            self.write_documents(documents)
+        except Exception as e:
+            print('Exception while trying to insert ' + str(len(documents)) + ' documents in ' + str(
+                    self) + ' (' + str(e) + '). Try once again, but one document after another.')
+            # Maybe we exceeded the 16MB, so better insert every document separately
+            for doc in documents:
+                self.write_documents([doc])
+        self.write_time += time.time() - st
+
+        # Now we know that the documents are written to this target, we can move the checkpoint
+        self.quantity += len(documents)
+        if len(documents) >= 1 and self.checkpoint_field in documents[-1]:
+            self.checkpoint = documents[-1][self.checkpoint_field]
+
+    """
+        Write the documents with the appropriate write mode. The upsert is only possible if every document has an _id.
+    """
+    def write_documents(self, documents):
+        if self.write_mode == 'upsert' and all('_id' in doc for doc in documents):
+            self.mongo.upsert_many(self.db, self.coll, documents)
+        else:
+            self.mongo.insert_many(self.db, self.coll, documents)
+
+    """
+        Asynchronously write a batch of documents. Block if the buffer of the target is full.
+    """
+    def put(self, documents):
+        self.raise_error()
+        self.queue.put(documents)
+
+    """
+        Wait for every buffered batch to be written
+    """
+    def flush(self):
+        if self.thread is not None:
+            self.queue.join()
+        self.raise_error()
+
+    """
+        Flush the remaining batches then stop the thread
+    """
+    def stop(self):
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        self.raise_error()
+
+    """
+        Main loop of the thread, writing every batch received
+    """
+    def run(self):
+        while True:
+            documents = self.queue.get()
+            try:
+                if documents is None:
+                    return
+                if self.error is None: # After an error, we simply drain the buffer to not block the reader
+                    self.write(documents)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    """
+        Raise in the caller thread any error which happened in the writer thread
+    """
+    def raise_error(self):
+        if self.error is not None:
+            raise ValueError('Problem while writing to ' + str(self) + ': ' + str(self.error))
+
+    def __str__(self):
+        return 'TargetWriter:' + str(self.mongo.host) + ':' + self.db + '.' + self.coll
+
+    def __repr__(self):
+        return self.__str__()
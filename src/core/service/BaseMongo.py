@@ -0,0 +1,247 @@
+from datetime import datetime, timezone
+from bson.objectid import ObjectId
+import pymongo
+
+"""
+    Interface of every backend used to access a MongoDB node: the real one (Mongo) and the in-memory one (FakeMongo). Every
+    query of mongosync goes through one of them. The methods only relying on other methods of the interface are directly
+    implemented here.
+"""
+class BaseMongo:
+    def __init__(self, configuration, is_primary, host=None):
+        self.is_primary = is_primary  # Correct value is "True" or "False"
+        self.configuration = configuration
+        self.host = host
+
+    """
+        Establish a connection to the node
+    """
+    def connect(self):
+        raise ValueError('To implement in the children.')
+
+    """
+        List the members of the replica set we are allowed to read from
+    """
+    def eligible_members(self):
+        raise ValueError('To implement in the children.')
+
+    """
+        Create a collection, useful for a capped collection
+    """
+    def create_collection(self, db, coll, capped=False, max=None, max_size=None):
+        raise ValueError('To implement in the children.')
+
+    """
+        Create an index
+    """
+    def create_index(self, db, coll, options):
+        raise ValueError('To implement in the children.')
+
+    """
+        Simply retrieve any document
+    """
+    def find_one(self, db, coll, query):
+        raise ValueError('To implement in the children.')
+
+    """
+        A generic find function, returning an iterable cursor
+    """
+    def find(self, db, coll, query, skip=0, limit=0, projection=None, sort_field='_id', sort_order=pymongo.ASCENDING, raw=False):
+        raise ValueError('To implement in the children.')
+
+    """
+        Find every document between two values of a given index
+    """
+    def find_range(self, db, coll, key_pattern, min_key, max_key, skip=0, raw=False):
+        raise ValueError('To implement in the children.')
+
+    """
+        A specific find method to read the oplog with a tailable cursor
+    """
+    def find_oplog(self, query, skip, limit, projection=None):
+        raise ValueError('To implement in the children.')
+
+    """
+        Information about the current oplog: first and last "ts", current size and maximum size (in bytes)
+    """
+    def oplog_window(self):
+        raise ValueError('To implement in the children.')
+
+    """
+        Read every oplog entry in ]start_ts; end_ts], without any tailable cursor
+    """
+    def find_oplog_range(self, start_ts, end_ts):
+        raise ValueError('To implement in the children.')
+
+    """
+        Number of documents matching a query
+    """
+    def count(self, db, coll, query):
+        raise ValueError('To implement in the children.')
+
+    """
+        Apply oplog entries (read from another node) to this node, return the number of applied entries
+    """
+    def apply_oplog(self, entries):
+        raise ValueError('To implement in the children.')
+
+    """
+        A FindOneAndUpdate which always return the document after modification
+    """
+    def find_one_and_update(self, db, coll, query, update):
+        raise ValueError('To implement in the children.')
+
+    """
+        A list of ids from a given collection, which could be use to "equally" split the collection (or its documents after the
+        given start_id). Return an empty list if not possible to do it.
+        Duplicate seeds are possible. _ids are not returned in any specific order.
+    """
+    def section_ids(self, db, coll, quantity, start_id=None):
+        # The "$sample" is slow, so we will try to generate random object ids ourselves
+
+        # We want to have some information about the smallest and biggest _id (we suppose that the _id is monotonously increasing).
+        # With a start_id, we only split the documents after it.
+        query = {} if start_id is None else {'_id': {'$gt': start_id}}
+        first = list(self.find(db=db, coll=coll, query=query, skip=0, limit=1, projection=None, sort_field='_id', sort_order=pymongo.ASCENDING))
+        if len(first) == 0:
+            return []
+        last = list(self.find(db=db, coll=coll, query={}, skip=0, limit=1, projection=None, sort_field='_id', sort_order=pymongo.DESCENDING))
+        if len(last) == 0:
+            return []
+        first = first[0]
+        last = last[0]
+
+        # Arbitrarily generate object ids between the minimal/maximal values
+        first_timestamp = first['_id'].generation_time.replace(tzinfo=timezone.utc).timestamp()
+        last_timestamp = last['_id'].generation_time.replace(tzinfo=timezone.utc).timestamp()
+        step = int(max(1,(last_timestamp - first_timestamp) / quantity))
+        section_ids = []
+        for offset in range(int(first_timestamp), int(last_timestamp), step):
+            current_date = datetime.utcfromtimestamp(offset)
+            section_id = {'_id':ObjectId.from_datetime(current_date)}
+            section_ids.append(section_id)
+
+        return section_ids
+
+    """
+        Indicates if the collection contains at least one document with an "_id" field, and if it's an ObjectId 
+    """
+    def id_type(self, db, coll):
+        first = list(self.find(db=db, coll=coll, query={}, skip=0, limit=1, projection=None, sort_field='_id', sort_order=pymongo.ASCENDING))
+        if len(first) == 0:
+            return {'has_id':False,'is_object_id':False}
+        first = first[0]
+
+        has_id = '_id' in first
+        is_object_id = False
+        if has_id:
+            is_object_id = isinstance(first['_id'], ObjectId)
+        return {'has_id':has_id,'is_object_id':is_object_id}
+
+    """
+        A simple insert_one
+    """
+    def insert_one(self, db, coll, document):
+        raise ValueError('To implement in the children.')
+
+    """
+        A simple insert_many, ignoring the duplicate key errors
+    """
+    def insert_many(self, db, coll, documents):
+        raise ValueError('To implement in the children.')
+
+    """
+        An idempotent alternative to the insert_many
+    """
+    def upsert_many(self, db, coll, documents):
+        raise ValueError('To implement in the children.')
+
+    """
+        Stats on a given collection, empty dict if the collection does not exist
+    """
+    def collection_stats(self, db, coll):
+        raise ValueError('To implement in the children.')
+
+    """
+        Information about each index on a collection
+    """
+    def get_indexes(self, db, coll):
+        raise ValueError('To implement in the children.')
+
+    """
+        A simple delete_many
+    """
+    def delete_many(self, db, coll, query):
+        raise ValueError('To implement in the children.')
+
+    """
+        List the shards of a sharded cluster
+    """
+    def list_shards(self):
+        raise ValueError('To implement in the children.')
+
+    """
+        Information about a sharded collection, or None if the collection is not sharded
+    """
+    def sharded_collection(self, db, coll):
+        raise ValueError('To implement in the children.')
+
+    """
+        List the chunks of a sharded collection, ordered by their lower boundary
+    """
+    def list_chunks(self, sharded_collection):
+        raise ValueError('To implement in the children.')
+
+    """
+        The primary shard of a database, None if it has no primary shard
+    """
+    def database_primary_shard(self, db):
+        raise ValueError('To implement in the children.')
+
+    """
+        Indicates if the balancer of a sharded cluster is enabled
+    """
+    def balancer_enabled(self):
+        raise ValueError('To implement in the children.')
+
+    """
+        Stop the balancer of a sharded cluster, once its current round is over
+    """
+    def stop_balancer(self):
+        raise ValueError('To implement in the children.')
+
+    """
+        Start the balancer of a sharded cluster
+    """
+    def start_balancer(self):
+        raise ValueError('To implement in the children.')
+
+    """
+        Indicates if a chunk migration is in progress in a sharded cluster
+    """
+    def migration_in_progress(self):
+        raise ValueError('To implement in the children.')
+
+    """
+        Number of bytes sent by the server on the network since its start
+    """
+    def network_bytes_out(self):
+        raise ValueError('To implement in the children.')
+
+    """
+        List all databases
+    """
+    def list_databases(self):
+        raise ValueError('To implement in the children.')
+
+    """
+        List all collections from a database
+    """
+    def list_collections(self, db):
+        raise ValueError('To implement in the children.')
+
+    """
+        Drop a collection
+    """
+    def drop(self, db, coll):
+        raise ValueError('To implement in the children.')
@@ -7,6 +7,8 @@ import json
 class Configuration:
     # This value can be overrided by the user
     FILEPATH = '/etc/mongosync/mongosync.json'
+    # Enabled with the "--profile" option
+    PROFILE = False
 
     def __init__(self):
         self.load(filepath=Configuration.FILEPATH)
@@ -19,10 +21,21 @@ class Configuration:
             self.conf = json.load(f)
 
     """
-        Return the mongo host out of synchronisation which would like to synchronize
+        Return the mongo host out of synchronisation which would like to synchronize. If we have multiple targets, the
+        first one is returned.
     """
     def mongo_host_out_of_sync(self):
-        return self.conf['mongo']['host']['out_of_sync']
+        return self.mongo_hosts_out_of_sync()[0]
+
+    """
+        Return every mongo host out of synchronisation. The "out_of_sync" value can be a single host or a list of hosts,
+        every document read from the in-sync node is written to all of them.
+    """
+    def mongo_hosts_out_of_sync(self):
+        hosts = self.conf['mongo']['host']['out_of_sync']
+        if isinstance(hosts, str):
+            return [hosts]
+        return hosts
 
     """
         Return the mongo host which will be the basis for the synchronisation
@@ -30,6 +43,107 @@ class Configuration:
     def mongo_host_in_sync(self):
         return self.conf['mongo']['host']['in_sync']
 
+    """
+        If set to True, the in-sync host is a mongos of a sharded cluster. The shards are then directly read in parallel.
+    """
+    def mongo_sharded(self):
+        return self.conf['mongo'].get('sharded', False)
+
+    """
+        Backend used to access the nodes: "mongodb" for real nodes, or "fake" for in-memory nodes generated from the
+        "fake" configuration (no server needed, useful for benchmarks and tests).
+    """
+    def mongo_backend(self):
+        return self.conf['mongo'].get('backend', 'mongodb')
+
+    """
+        Latency added to every query of the fake backend. Return a number in milliseconds.
+    """
+    def mongo_fake_latency(self):
+        return self.conf['mongo'].get('fake', {}).get('latency_ms', 0)
+
+    """
+        Bandwidth of the fake backend, 0 means no limit. Return a number in MB/s.
+    """
+    def mongo_fake_bandwidth(self):
+        return self.conf['mongo'].get('fake', {}).get('bandwidth_MBps', 0)
+
+    """
+        Collections generated on the in-sync node of the fake backend:
+        {<db>: {<coll>: {"documents": <quantity>, "document_bytes": <size>}}}
+        With fake shards, a collection can also be sharded on its _id: {"sharded": true, "chunks": <quantity>}.
+    """
+    def mongo_fake_databases(self):
+        return self.conf['mongo'].get('fake', {}).get('databases', {})
+
+    """
+        Number of shards simulated by the fake backend, 0 for a replica set. With shards, the in-sync node is a mongos.
+    """
+    def mongo_fake_shards(self):
+        return self.conf['mongo'].get('fake', {}).get('shards', 0)
+
+    """
+        Number of entries per second in the simulated oplog of the fake backend
+    """
+    def mongo_fake_oplog_entries_per_s(self):
+        return self.conf['mongo'].get('fake', {}).get('oplog_entries_per_s', 10)
+
+    """
+        Window of the simulated oplog of the fake backend. Return a number in seconds.
+    """
+    def mongo_fake_oplog_window(self):
+        return self.conf['mongo'].get('fake', {}).get('oplog_window_s', 3600)
+
+    """
+        Name of the replica set of the in-sync host. If None, we simply connect to the given host(s).
+    """
+    def mongo_in_sync_replica_set(self):
+        return self.conf['mongo']['host'].get('in_sync_replica_set', None)
+
+    """
+        Read preference used to read from the in-sync replica set: primary, primaryPreferred, secondary, secondaryPreferred
+        or nearest.
+    """
+    def mongo_read_preference_mode(self):
+        return self.conf['mongo'].get('read_preference', {}).get('mode', 'primary')
+
+    """
+        List of tag sets (ex: [{"usage": "analytics"}, {}]) to select the members we can read from. Empty list means no
+        restriction.
+    """
+    def mongo_read_preference_tag_sets(self):
+        return self.conf['mongo'].get('read_preference', {}).get('tag_sets', [])
+
+    """
+        Explicit list of members (host:port) to read from. If empty, they will be discovered from the replica set
+        configuration, based on the read preference and the tag sets.
+    """
+    def mongo_read_preference_members(self):
+        return self.conf['mongo'].get('read_preference', {}).get('members', [])
+
+    """
+        If set to True, the CollectionParts will be spread over every eligible member of the in-sync replica set, to
+        multiply the read bandwidth.
+    """
+    def mongo_read_preference_spread_reads(self):
+        return self.conf['mongo'].get('read_preference', {}).get('spread_reads', False)
+
+    """
+        Wire compressors to use with every node, by order of preference (ex: "zstd,snappy,zlib"). Empty string to disable
+        the compression. The compressor must be supported by the server and the related python package must be installed.
+    """
+    def mongo_compressors(self):
+        compressors = self.conf['mongo'].get('compressors', '')
+        if isinstance(compressors, list):
+            return ','.join(compressors)
+        return compressors
+
+    """
+        Compression level if the zlib compressor is used, from -1 (default level) to 9
+    """
+    def mongo_zlib_compression_level(self):
+        return self.conf['mongo'].get('zlib_compression_level', -1)
+
     """
         To allow a long synchronisation without crash, we might need to set a big number for the oplog
     """
@@ -91,12 +205,174 @@ class Configuration:
     def internal_test_write_document_size(self):
         return self.conf['internal']['test_write_document_bytes']
 
+    """
+        How the documents are written to the out-of-sync nodes: "insert" (duplicate key errors are ignored) or "upsert"
+        (idempotent bulk replace, faster to re-sync into a non-empty target).
+    """
+    def internal_write_mode(self):
+        return self.conf['internal'].get('write_mode', 'insert')
+
+    """
+        Number of documents used by the test-write-mode benchmark
+    """
+    def internal_test_write_mode_documents(self):
+        return int(self.conf['internal'].get('test_write_mode_documents', 20000))
+
+    """
+        Number of processes used to fetch the backlog of the oplog in parallel, before tailing it. Value <= 1 disables
+        the parallel catch-up.
+    """
+    def internal_oplog_catchup_processes(self):
+        return int(self.conf['internal'].get('oplog_catchup_processes', 4))
+
+    """
+        Minimum backlog of the oplog to use the parallel catch-up. Return a number in seconds.
+    """
+    def internal_oplog_catchup_threshold(self):
+        return self.conf['internal'].get('oplog_catchup_threshold_s', 600)
+
+    """
+        Maximum size of a job made of small collections (with only one CollectionPart), synced one after another with the
+        same connections. Return a number in MB. Value <= 0 disables the coalescing.
+    """
+    def internal_small_collections_job_size(self):
+        return self.conf['internal'].get('small_collections_job_MB', 64)
+
+    """
+        Directory of the local disk spool between the reads and the writes. None disables the spool. It is cleared at the
+        start of each run, so it must not be shared with another mongosync instance running at the same time.
+    """
+    def internal_spool_directory(self):
+        return self.conf['internal'].get('spool', {}).get('directory', None)
+
+    """
+        Maximum size of the spool directory (shared by every process). Return a number in GB.
+    """
+    def internal_spool_max_size(self):
+        return self.conf['internal'].get('spool', {}).get('max_size_GB', 50)
+
+    """
+        Size of each segment of the spool. Return a number in MB.
+    """
+    def internal_spool_segment_size(self):
+        return self.conf['internal'].get('spool', {}).get('segment_MB', 64)
+
+    """
+        Directory of the local journal of the oplog, in which the oplog entries are written until the end of the clone of
+        the other collections, to be replayed afterwards. None disables the journal (the entries are directly written).
+    """
+    def internal_oplog_journal_directory(self):
+        return self.conf['internal'].get('oplog_journal', {}).get('directory', None)
+
+    """
+        Size of each segment of the oplog journal, before compression. Return a number in MB.
+    """
+    def internal_oplog_journal_segment_size(self):
+        return self.conf['internal'].get('oplog_journal', {}).get('segment_MB', 64)
+
+    """
+        Zlib compression level of the oplog journal, from 1 (fastest) to 9 (smallest)
+    """
+    def internal_oplog_journal_compression_level(self):
+        return self.conf['internal'].get('oplog_journal', {}).get('compression_level', 6)
+
+    """
+        Namespaces ("db.coll", or "db.*" for a whole database) of the append-only collections, for which the top-up only
+        copies the documents after the biggest _id of the targets.
+    """
+    def internal_top_up_append_only(self):
+        return self.conf['internal'].get('top_up', {}).get('append_only', [])
+
+    """
+        Indicates if the top-up should consider a collection which is not listed as append-only if the source and the
+        targets have the same number of documents up to the biggest _id of the targets. This does not detect the updates.
+    """
+    def internal_top_up_detect_append_only(self):
+        return self.conf['internal'].get('top_up', {}).get('detect_append_only', False)
+
+    """
+        Indicates if the CollectionParts should be published in a work queue, to be cloned by multiple mongosync instances
+        (started with the "worker" operation on other hosts)
+    """
+    def internal_distributed(self):
+        return self.conf['internal'].get('distributed', {}).get('enabled', False)
+
+    """
+        Collection of the work queue, in the internal database of the first out-of-sync node
+    """
+    def internal_work_queue_collection(self):
+        return self.conf['internal'].get('distributed', {}).get('collection', 'work_queue')
+
+    """
+        Duration of the lease of a job claimed from the work queue, extended by heartbeats. Return a number in seconds.
+    """
+    def internal_work_queue_lease(self):
+        return self.conf['internal'].get('distributed', {}).get('lease_s', 120)
+
+    """
+        Maximum number of bytes/s read from the in-sync node, for every process (except the oplog, which is never
+        throttled). Value <= 0 means no limit. This value can be changed while the sync is running, it is regularly reloaded.
+    """
+    def internal_rate_limit_bytes(self):
+        return self.conf['internal'].get('rate_limit', {}).get('MB_per_s', 0) * (1024 ** 2)
+
+    """
+        Maximum number of documents/s read from the in-sync node, for every process (except the oplog, which is never
+        throttled). Value <= 0 means no limit. This value can be changed while the sync is running, it is regularly
+        reloaded.
+    """
+    def internal_rate_limit_docs(self):
+        return self.conf['internal'].get('rate_limit', {}).get('docs_per_s', 0)
+
     """
         Number of threads to use for the synchronisation. The thread for the oplog is not counted in it and it will be automatically added
     """
     def internal_threads(self):
         return int(max(1,self.conf['internal']['threads']))
 
+    """
+        Maximum number of batches buffered for each target when we write to multiple targets at once. A slow target cannot
+        be late by more than this number of batches compared to the fastest one.
+    """
+    def internal_target_buffer(self):
+        return int(max(1, self.conf['internal'].get('target_buffer', 4)))
+
+    """
+        Number of collections (the biggest ones) used by the "plan" operation to sample the read throughput
+    """
+    def internal_plan_sample_collections(self):
+        return int(max(1, self.conf['internal'].get('plan_sample_collections', 5)))
+
+    """
+        Number of ranges read in each sampled collection by the "plan" operation
+    """
+    def internal_plan_sample_ranges(self):
+        return int(max(1, self.conf['internal'].get('plan_sample_ranges', 3)))
+
+    """
+        Amount of data to read in each sampled range by the "plan" operation. Return a number in MB.
+    """
+    def internal_plan_sample_size(self):
+        return self.conf['internal'].get('plan_sample_MB', 16)
+
+    """
+        Directory where every process writes its profiling results, with the "--profile" option
+    """
+    def internal_profile_directory(self):
+        return self.conf['internal'].get('profile', {}).get('directory', '/tmp/mongosync-profile')
+
+    """
+        If set to True, the "--profile" option also runs a sampling profiler in every process
+    """
+    def internal_profile_sampling(self):
+        return self.conf['internal'].get('profile', {}).get('sampling', False)
+
+    """
+        Interval between two samples of the sampling profiler. Return a number in milliseconds.
+    """
+    def internal_profile_sampling_interval(self):
+        return max(1, self.conf['internal'].get('profile', {}).get('sampling_interval_ms', 10))
+
     """
         Indicates if we are in a development mode (= clean database before mount for example) or not.
     """
@@ -0,0 +1,548 @@
+import bisect
+import copy
+import itertools
+import struct
+import time
+from bson import BSON
+from bson.objectid import ObjectId
+from bson.timestamp import Timestamp
+from bson.min_key import MinKey
+from bson.max_key import MaxKey
+from bson.raw_bson import RawBSONDocument
+import pymongo
+from src.core.service.BaseMongo import BaseMongo
+from src.core.service.Profiler import Profiler
+
+"""
+    Simple cursor over a list (or any iterable) of documents, with the few attributes of a pymongo cursor we use
+"""
+class FakeCursor:
+    def __init__(self, documents, alive=False):
+        self.iterator = iter(documents)
+        self.alive = alive
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.iterator)
+
+    def next(self):
+        return self.__next__()
+
+"""
+    Simulated oplog of the in-sync node: every second has "entries_per_s" entries, over the last "window_s" seconds. The
+    entries are generated on the fly from their "ts", so every process sees exactly the same oplog without sharing anything.
+"""
+class FakeOplog:
+    def __init__(self, entries_per_s, window_s):
+        self.entries_per_s = int(max(1, entries_per_s))
+        self.window_s = int(max(1, window_s))
+
+    def first_ts(self):
+        return Timestamp(int(time.time()) - self.window_s, 1)
+
+    """
+        We only give the entries of the seconds which are over, to never have a new entry before an existing one
+    """
+    def last_ts(self):
+        return Timestamp(int(time.time()) - 1, self.entries_per_s)
+
+    def entry(self, t, i):
+        return {'ts': Timestamp(t, i), 't': 1, 'h': t * self.entries_per_s + i, 'v': 2, 'op': 'i', 'ns': 'fake.oplog',
+                'o': {'_id': ObjectId(struct.pack('>IQ', t, i)), 'value': i}}
+
+    """
+        Entries in ]start_ts; end_ts]. Both boundaries are optional.
+    """
+    def entries(self, start_ts=None, end_ts=None):
+        first = self.first_ts()
+        if start_ts is None or start_ts < first:
+            t, i = first.time, 0
+        else:
+            t, i = start_ts.time, start_ts.inc
+        while True:
+            i += 1
+            if i > self.entries_per_s:
+                t, i = t + 1, 1
+            ts = Timestamp(t, i)
+            if ts > self.last_ts() or (end_ts is not None and ts > end_ts):
+                return
+            yield self.entry(t, i)
+
+    def stats(self):
+        average_object_size = len(BSON.encode(self.entry(int(time.time()), 1)))
+        count = self.entries_per_s * self.window_s
+        return {'ns': 'local.oplog.rs', 'count': count, 'size': count * average_object_size, 'avgObjSize': average_object_size,
+                'storageSize': count * average_object_size, 'capped': True, 'max': -1, 'maxSize': count * average_object_size}
+
+"""
+    Tailable cursor on the FakeOplog: once we reach the last entry, the iteration stops but the cursor stays alive, and
+    the next iteration continues with the new entries.
+"""
+class FakeOplogCursor:
+    def __init__(self, oplog, start_ts, limit=0):
+        self.oplog = oplog
+        self.start_ts = start_ts
+        self.limit = limit
+        self.quantity = 0
+        self.alive = True
+        self.iterator = self.oplog.entries(self.start_ts)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.limit > 0 and self.quantity >= self.limit:
+            self.alive = False
+            raise StopIteration
+        try:
+            doc = next(self.iterator)
+        except StopIteration:
+            # Continue from the last entry at the next iteration
+            self.iterator = self.oplog.entries(self.start_ts)
+            raise
+        self.start_ts = doc['ts']
+        self.quantity += 1
+        return doc
+
+    def next(self):
+        return self.__next__()
+
+"""
+    In-memory collection. The documents are stored as BSON, so the encoding / decoding costs are the same as with a real
+    MongoDB node.
+"""
+class FakeCollection:
+    def __init__(self, capped=False, max=None, max_size=None):
+        self.documents = {} # _id -> BSON
+        self.sorted_ids = []
+        self.is_sorted = True
+        self.capped = capped
+        self.max = max
+        self.max_size = max_size
+        self.indexes = {'_id_': {'key': [('_id', 1)], 'v': 2}}
+
+    def put(self, _id, data):
+        if _id not in self.documents:
+            self.sorted_ids.append(_id)
+            self.is_sorted = False
+        self.documents[_id] = data
+
+    def remove(self, _id):
+        del self.documents[_id]
+        self.sorted_ids.remove(_id)
+
+    def ids(self):
+        if not self.is_sorted:
+            self.sorted_ids.sort()
+            self.is_sorted = True
+        return self.sorted_ids
+
+    def size(self):
+        return sum([len(data) for data in self.documents.values()])
+
+"""
+    In-memory backend, used instead of the real MongoDB nodes with the "fake" backend. The in-sync node is generated from the
+    configuration (databases, collections, number and size of the documents, and a simulated oplog), the out-of-sync nodes
+    start empty. Latency and bandwidth can be injected to simulate the network. The data is stored in the memory of the
+    current process: the worker processes all see the same in-sync node, but their writes are not visible to the others.
+    The goal is to benchmark and test the pipeline (batching, scheduling, decode costs) without any server.
+    With fake shards, the in-sync node is a mongos with every document, and each shard ("shard<i>/fake-shard<i>:27017")
+    only has the documents of its chunks (and the unsharded collections for shard0, the primary shard of every database),
+    with its own oplog. The sharded collections are split in chunks of the same number of documents, given to the shards in
+    turn.
+"""
+class FakeMongo(BaseMongo):
+    # Nodes of the current process: name -> {db: {coll: FakeCollection}}
+    NODES = {}
+    # Statistics of each node
+    BYTES_OUT = {}
+    # State of the balancer of the fake mongos of the current process
+    BALANCER = {'enabled': True, 'migration': False}
+
+    def __init__(self, configuration, is_primary, host=None):
+        BaseMongo.__init__(self, configuration, is_primary, host=host)
+        self.latency = configuration.mongo_fake_latency() / 1000
+        self.bandwidth = configuration.mongo_fake_bandwidth() * (1024 ** 2)
+        self.oplog = None
+        self.connect()
+
+    """
+        Get (or generate) the node. Every member of the in-sync replica set has the same data.
+    """
+    def connect(self):
+        if self.is_primary:
+            self.shard = self.host.split('/')[0] if self.host in self.shard_hosts().values() else None
+            self.name = 'in_sync' if self.shard is None else 'in_sync:' + self.shard
+            self.oplog = FakeOplog(self.configuration.mongo_fake_oplog_entries_per_s(), self.configuration.mongo_fake_oplog_window())
+        else:
+            self.shard = None
+            self.name = 'out_of_sync:' + str(self.host if self.host is not None else self.configuration.mongo_host_out_of_sync())
+        if self.name not in FakeMongo.NODES:
+            FakeMongo.NODES[self.name] = {}
+            FakeMongo.BYTES_OUT[self.name] = 0
+            if self.is_primary:
+                self.generate()
+        self.node = FakeMongo.NODES[self.name]
+
+    """
+        Generate the collections of the in-sync node, the same way in every process
+    """
+    def generate(self):
+        node = FakeMongo.NODES[self.name]
+        for db, collections in self.configuration.mongo_fake_databases().items():
+            node[db] = {}
+            for coll, options in collections.items():
+                # A shard only has the chunks it owns, and the unsharded collections if it is the primary shard
+                chunks = self.chunks(db, coll)
+                if self.shard is not None and len(chunks) == 0 and self.shard != 'shard0':
+                    continue
+                collection = FakeCollection()
+                payload = 'x' * int(options.get('document_bytes', 1024))
+                for i in range(int(options.get('documents', 0))):
+                    # 100 documents per second, to have ObjectIds spread over time like in reality
+                    _id = FakeMongo.generated_id(i)
+                    if self.shard is not None and len(chunks) > 0 and not any(chunk['shard'] == self.shard and chunk['min']['_id'] <= _id < chunk['max']['_id'] for chunk in chunks):
+                        continue
+                    collection.put(_id, BSON.encode({'_id': _id, 'i': i, 'payload': payload}))
+                node[db][coll] = collection
+
+    @staticmethod
+    def generated_id(i):
+        return ObjectId(struct.pack('>IQ', 1500000000 + i // 100, i))
+
+    """
+        Shards of the fake sharded cluster: shard id -> host. Empty for a replica set.
+    """
+    def shard_hosts(self):
+        return {'shard' + str(i): 'shard' + str(i) + '/fake-shard' + str(i) + ':27017' for i in range(int(self.configuration.mongo_fake_shards()))}
+
+    """
+        Chunks of a generated collection, empty if it is not sharded. The chunks have the same number of documents, and are
+        given to the shards in turn.
+    """
+    def chunks(self, db, coll):
+        options = self.configuration.mongo_fake_databases().get(db, {}).get(coll, {})
+        shards = sorted(self.shard_hosts().keys())
+        if len(shards) == 0 or not options.get('sharded', False):
+            return []
+        documents = int(options.get('documents', 0))
+        quantity = int(max(1, options.get('chunks', 2 * len(shards))))
+        boundaries = [MinKey()] + [FakeMongo.generated_id(k * documents // quantity) for k in range(1, quantity)] + [MaxKey()]
+        return [{'ns': db + '.' + coll, 'min': {'_id': boundaries[k]}, 'max': {'_id': boundaries[k + 1]}, 'shard': shards[k % len(shards)]} for k in range(quantity)]
+
+    """
+        Simulate the network latency and bandwidth
+    """
+    def delay(self, size=0):
+        duration = self.latency
+        if self.bandwidth > 0:
+            duration += size / self.bandwidth
+        if duration > 0:
+            time.sleep(duration)
+
+    def is_oplog(self, db, coll):
+        return self.oplog is not None and db == 'local' and coll == 'oplog.rs'
+
+    def collection(self, db, coll):
+        return self.node.get(db, {}).get(coll, None)
+
+    """
+        Indicates if a document matches a (simple) query: equality, $gt, $gte, $lt, $lte, $ne, $in on any field
+    """
+    @staticmethod
+    def matches(doc, query):
+        for field, condition in query.items():
+            value = doc.get(field, None)
+            if isinstance(condition, dict) and len(condition) > 0 and all(key.startswith('$') for key in condition):
+                for operator, expected in condition.items():
+                    if operator == '$ne' and value == expected:
+                        return False
+                    if operator == '$in' and value not in expected:
+                        return False
+                    if operator in ['$gt', '$gte', '$lt', '$lte'] and value is None:
+                        return False
+                    if (operator == '$gt' and not value > expected) or (operator == '$gte' and not value >= expected) or \
+                            (operator == '$lt' and not value < expected) or (operator == '$lte' and not value <= expected):
+                        return False
+            elif value != condition:
+                return False
+        return True
+
+    def eligible_members(self):
+        return self.configuration.mongo_read_preference_members()
+
+    def create_collection(self, db, coll, capped=False, max=None, max_size=None):
+        self.delay()
+        if self.collection(db, coll) is None:
+            self.node.setdefault(db, {})[coll] = FakeCollection(capped=capped, max=max, max_size=max_size)
+
+    def create_index(self, db, coll, options):
+        self.delay()
+        self.create_collection(db, coll)
+        options = dict(options)
+        keys = options.pop('keys')
+        name = options.pop('name', '_'.join([str(key) + '_' + str(order) for key, order in keys]))
+        options['key'] = list(keys)
+        self.collection(db, coll).indexes[name] = options
+        return name
+
+    def find_one(self, db, coll, query):
+        documents = list(self.find(db, coll, query, limit=1, sort_field=None))
+        return documents[0] if len(documents) > 0 else None
+
+    def find(self, db, coll, query, skip=0, limit=0, projection=None, sort_field='_id', sort_order=pymongo.ASCENDING, raw=False):
+        if self.is_oplog(db, coll):
+            documents = (doc for doc in self.oplog.entries() if FakeMongo.matches(doc, query))
+            return FakeCursor(itertools.islice(documents, skip, skip + limit if limit > 0 else None))
+
+        collection = self.collection(db, coll)
+        if collection is None:
+            self.delay()
+            return FakeCursor([])
+
+        # Fast path for the range queries on the _id, the most common ones
+        id_query = query.get('_id', {}) if list(query.keys()) in [[], ['_id']] else None
+        if isinstance(id_query, dict) and sort_field in ['_id', None] and all(key in ['$gt', '$gte', '$lt', '$lte'] for key in id_query):
+            ids = collection.ids()
+            start, end = 0, len(ids)
+            if '$gte' in id_query:
+                start = bisect.bisect_left(ids, id_query['$gte'])
+            if '$gt' in id_query:
+                start = bisect.bisect_right(ids, id_query['$gt'])
+            if '$lte' in id_query:
+                end = bisect.bisect_right(ids, id_query['$lte'])
+            if '$lt' in id_query:
+                end = bisect.bisect_left(ids, id_query['$lt'])
+            selected = ids[start:end]
+            if sort_order == pymongo.DESCENDING:
+                selected = list(reversed(selected))
+            selected = selected[skip:skip + limit] if limit > 0 else selected[skip:]
+            data = [collection.documents[_id] for _id in selected]
+        else:
+            data = [data for data in collection.documents.values() if FakeMongo.matches(BSON(data).decode(), query)]
+            if sort_field is not None:
+                data = sorted(data, key=lambda d: BSON(d).decode().get(sort_field), reverse=sort_order == pymongo.DESCENDING)
+            data = data[skip:skip + limit] if limit > 0 else data[skip:]
+
+        size = sum([len(d) for d in data])
+        FakeMongo.BYTES_OUT[self.name] += size
+        self.delay(size)
+        if raw:
+            return FakeCursor([RawBSONDocument(d) for d in data])
+        return FakeCursor([BSON(d).decode() for d in data])
+
+    def find_range(self, db, coll, key_pattern, min_key, max_key, skip=0, raw=False):
+        if list(key_pattern.keys()) != ['_id']:
+            raise ValueError('The FakeMongo only supports collections sharded on the _id.')
+        self.delay()
+        collection = self.collection(db, coll)
+        ids = collection.ids() if collection is not None else []
+        selected = [_id for _id in ids if min_key['_id'] <= _id < max_key['_id']][skip:]
+        data = [collection.documents[_id] for _id in selected]
+        FakeMongo.BYTES_OUT[self.name] += sum([len(d) for d in data])
+        if raw:
+            return FakeCursor([RawBSONDocument(d) for d in data])
+        return FakeCursor([BSON(d).decode() for d in data])
+
+    def find_oplog(self, query, skip, limit, projection=None):
+        self.delay()
+        start_ts = query.get('ts', {}).get('$gt', None)
+        if start_ts is None:
+            start_ts = self.oplog.first_ts() # Same as the real implementation, we skip the first entry
+        return FakeOplogCursor(self.oplog, start_ts, limit=limit)
+
+    def oplog_window(self):
+        self.delay()
+        if self.oplog is None:
+            return None
+        stats = self.oplog.stats()
+        return {'first_ts': self.oplog.first_ts(), 'last_ts': self.oplog.last_ts(), 'size': stats['size'], 'max_size': stats['maxSize']}
+
+    def find_oplog_range(self, start_ts, end_ts):
+        self.delay()
+        return FakeCursor(self.oplog.entries(start_ts, end_ts))
+
+    """
+        Same filtering as the real implementation, but the transactions (applyOps of the admin database) and the updates
+        with operators other than $set / $unset are not supported.
+    """
+    def apply_oplog(self, entries):
+        self.delay()
+        n = 0
+        for entry in entries:
+            db, coll = entry['ns'].split('.', 1)
+            if entry['op'] == 'n' or entry.get('fromMigrate', False) or db in ['admin', 'config', 'local']:
+                continue
+            if entry['op'] == 'i':
+                self.upsert_many(db, coll, [entry['o']])
+            elif entry['op'] == 'd':
+                self.delete_many(db, coll, {'_id': entry['o']['_id']})
+            elif entry['op'] == 'u' and not any(key.startswith('$') for key in entry['o']):
+                self.upsert_many(db, coll, [entry['o']])
+            elif entry['op'] == 'u' and all(key in ['$set', '$unset', '$v'] for key in entry['o']):
+                collection = self.collection(db, coll)
+                _id = entry['o2']['_id']
+                if collection is not None and _id in collection.documents:
+                    doc = BSON(collection.documents[_id]).decode()
+                    doc.update(entry['o'].get('$set', {}))
+                    for field in entry['o'].get('$unset', {}):
+                        doc.pop(field, None)
+                    collection.put(_id, BSON.encode(doc))
+            else:
+                raise ValueError('Oplog entry not supported by the FakeMongo: '+str(entry))
+            n += 1
+        return n
+
+    def count(self, db, coll, query):
+        self.delay()
+        collection = self.collection(db, coll)
+        if collection is None:
+            return 0
+        return len([data for data in collection.documents.values() if FakeMongo.matches(BSON(data).decode(), query)])
+
+    """
+        Only the $set, $unset and $inc operators are supported
+    """
+    def find_one_and_update(self, db, coll, query, update):
+        self.delay()
+        collection = self.collection(db, coll)
+        if collection is None:
+            return None
+        for _id, data in collection.documents.items():
+            doc = BSON(data).decode()
+            if FakeMongo.matches(doc, query):
+                for field, value in update.get('$set', {}).items():
+                    doc[field] = value
+                for field in update.get('$unset', {}):
+                    doc.pop(field, None)
+                for field, value in update.get('$inc', {}).items():
+                    doc[field] = doc.get(field, 0) + value
+                collection.put(_id, BSON.encode(doc))
+                return doc
+        return None
+
+    def insert_one(self, db, coll, document):
+        return self.insert_many(db, coll, [document])
+
+    def insert_many(self, db, coll, documents):
+        with Profiler.phase('insert_many'):
+            self.create_collection(db, coll)
+            collection = self.collection(db, coll)
+            size = 0
+            for doc in documents:
+                if isinstance(doc, RawBSONDocument):
+                    data = doc.raw
+                else:
+                    if '_id' not in doc:
+                        doc['_id'] = ObjectId()
+                    data = BSON.encode(doc)
+                size += len(data)
+                _id = doc['_id'] if '_id' in doc else ObjectId() # Like the server, for the raw documents without _id
+                if _id not in collection.documents: # The duplicate key errors are ignored
+                    collection.put(_id, data)
+            self.delay(size)
+        return []
+
+    def upsert_many(self, db, coll, documents):
+        with Profiler.phase('upsert_many'):
+            self.create_collection(db, coll)
+            collection = self.collection(db, coll)
+            size = 0
+            for doc in documents:
+                data = doc.raw if isinstance(doc, RawBSONDocument) else BSON.encode(doc)
+                size += len(data)
+                collection.put(doc['_id'], data)
+            self.delay(size)
+
+    def collection_stats(self, db, coll):
+        self.delay()
+        if self.is_oplog(db, coll):
+            return self.oplog.stats()
+        collection = self.collection(db, coll)
+        if collection is None:
+            print('Problem to get stats for '+str(db)+'.'+str(coll)+'. Generally it is because of the collection not existing.')
+            return {}
+        count = len(collection.documents)
+        size = collection.size()
+        stats = {'ns': db + '.' + coll, 'count': count, 'size': size, 'storageSize': size, 'capped': collection.capped}
+        if count > 0:
+            stats['avgObjSize'] = size / count
+        if collection.capped:
+            stats['max'] = collection.max if collection.max is not None else -1
+            stats['maxSize'] = collection.max_size if collection.max_size is not None else -1
+        return stats
+
+    def get_indexes(self, db, coll):
+        self.delay()
+        if self.is_oplog(db, coll):
+            return {}
+        collection = self.collection(db, coll)
+        return copy.deepcopy(collection.indexes) if collection is not None else {}
+
+    def delete_many(self, db, coll, query):
+        self.delay()
+        collection = self.collection(db, coll)
+        if collection is None:
+            return 0
+        ids = [_id for _id, data in collection.documents.items() if FakeMongo.matches(BSON(data).decode(), query)]
+        for _id in ids:
+            collection.remove(_id)
+        return len(ids)
+
+    def list_shards(self):
+        return [{'_id': shard, 'host': host} for shard, host in sorted(self.shard_hosts().items())]
+
+    def sharded_collection(self, db, coll):
+        if len(self.chunks(db, coll)) == 0:
+            return None
+        return {'_id': db + '.' + coll, 'key': {'_id': 1}}
+
+    def list_chunks(self, sharded_collection):
+        db, coll = sharded_collection['_id'].split('.', 1)
+        return self.chunks(db, coll)
+
+    def database_primary_shard(self, db):
+        if len(self.shard_hosts()) == 0 or db in ['admin', 'config', 'local']:
+            return None
+        return 'shard0'
+
+    def balancer_enabled(self):
+        return FakeMongo.BALANCER['enabled']
+
+    def stop_balancer(self):
+        FakeMongo.BALANCER['enabled'] = False
+
+    def start_balancer(self):
+        FakeMongo.BALANCER['enabled'] = True
+
+    def migration_in_progress(self):
+        return FakeMongo.BALANCER['migration']
+
+    def network_bytes_out(self):
+        return FakeMongo.BYTES_OUT[self.name]
+
+    def list_databases(self):
+        self.delay()
+        databases = [db for db in self.node if len(self.node[db]) > 0]
+        if self.oplog is not None and 'local' not in databases:
+            databases.append('local')
+        return databases
+
+    def list_collections(self, db):
+        self.delay()
+        collections = list(self.node.get(db, {}).keys())
+        if self.oplog is not None and db == 'local' and 'oplog.rs' not in collections:
+            collections.append('oplog.rs')
+        return collections
+
+    def drop(self, db, coll):
+        self.delay()
+        self.node.get(db, {}).pop(coll, None)
+
+    def __str__(self):
+        return 'FakeMongo:' + self.name
+
+    def __repr__(self):
+        return self.__str__()
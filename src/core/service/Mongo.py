@@ -6,12 +6,15 @@ import os
 import signal
 import subprocess
 import time
-from datetime import datetime, timezone
-from bson.objectid import ObjectId
+from bson import BSON
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
 import pymongo
 from pymongo.errors import PyMongoError
-from pymongo import MongoClient
+from pymongo import MongoClient, ReplaceOne
 from pymongo.collection import ReturnDocument
+from src.core.service.Profiler import Profiler
+from src.core.service.BaseMongo import BaseMongo
 
 from functools import wraps
 import copy
@@ -66,11 +69,19 @@ def retry_connection(view_func):
 """
     This class will implement every method that we need to connect to MongoDB, and every query should be run through it (with the exceptions of tests). 
     This is also an easy to handle the disconnection to MongoDB during a short amount of time.
+    Instances should be created through the MongoFactory, to be able to use the FakeMongo backend instead.
 """
-class Mongo:
-    def __init__(self, configuration, is_primary):
-        self.is_primary = is_primary  # Correct value is "True" or "False"
-        self.configuration = configuration
+class Mongo(BaseMongo):
+    """
+        The host is optional. If given for the primary (= the in-sync node), we directly connect to that specific member of
+        the replica set instead of going through the replica set with the configured read preference. If given for the
+        secondary, it is one of the out-of-sync targets (by default, the first one).
+        The compressors are the wire compressors to use ("zstd,snappy" for example), by default the ones from the
+        configuration. An empty string disables the compression.
+    """
+    def __init__(self, configuration, is_primary, host=None, compressors=None):
+        BaseMongo.__init__(self, configuration, is_primary, host=host)
+        self.compressors = compressors if compressors is not None else configuration.mongo_compressors()
 
         retry_connection(self.connect())
 
@@ -78,11 +89,78 @@ class Mongo:
         Establish a connection to mongodb
     """
     def connect(self):
-        host = self.configuration.mongo_host_in_sync()
+        options = {'w': self.configuration.mongo_write_acknowledgement(), 'j': self.configuration.mongo_write_j()}
+        if self.compressors != '':
+            options['compressors'] = self.compressors
+            options['zlibCompressionLevel'] = self.configuration.mongo_zlib_compression_level()
         if self.is_primary is False:
-            host = self.configuration.mongo_host_out_of_sync()
+            host = self.host if self.host is not None else self.configuration.mongo_host_out_of_sync()
+        elif self.host is not None and '/' not in self.host:
+            # Direct connection to a single member (it might be a secondary, or even a hidden one)
+            host = self.host
+            options['readPreference'] = 'secondaryPreferred'
+        else:
+            host = self.configuration.mongo_host_in_sync()
+            replica_set = self.configuration.mongo_in_sync_replica_set()
+            if self.host is not None:
+                # Replica set given as "<replica_set>/<host1>,<host2>", like the hosts of the shards of a sharded cluster
+                replica_set, host = self.host.split('/', 1)
+            if replica_set is not None:
+                options['replicaSet'] = replica_set
+            options['readPreference'] = self.configuration.mongo_read_preference_mode()
+            tag_sets = self.configuration.mongo_read_preference_tag_sets()
+            if len(tag_sets) > 0:
+                options['readPreferenceTags'] = [','.join([str(k)+':'+str(v) for k, v in tag_set.items()]) for tag_set in tag_sets]
         mongo_path = 'mongodb://' + host
-        self.instance = MongoClient(mongo_path, w=self.configuration.mongo_write_acknowledgement(), j=self.configuration.mongo_write_j())
+        self.instance = MongoClient(mongo_path, event_listeners=Profiler.event_listeners(), **options)
+
+    """
+        List the members of the replica set we are allowed to read from, based on the read preference and the tag sets.
+        Hidden members are included, as we directly connect to them, but not the delayed members (they are far behind, so
+        they must be explicitly configured to be used). Return an empty list if we are not connected to a replica set, in
+        that case the reads cannot be spread.
+    """
+    @retry_connection
+    def eligible_members(self):
+        configured_members = self.configuration.mongo_read_preference_members()
+        if len(configured_members) > 0:
+            return configured_members
+
+        try:
+            members = self.instance.admin.command('replSetGetConfig')['config']['members']
+            status = self.instance.admin.command('replSetGetStatus')
+        except pymongo.errors.OperationFailure as e:
+            print('Problem to get the replica set configuration ('+str(e)+'), we will not spread the reads.')
+            return []
+        states = {member['name']: member['stateStr'] for member in status['members']}
+
+        primaries = [member for member in members if states.get(member['host']) == 'PRIMARY']
+        secondaries = [member for member in members if states.get(member['host']) == 'SECONDARY'
+                       and member.get('slaveDelay', 0) == 0 and member.get('secondaryDelaySecs', 0) == 0]
+
+        # The tag sets are tried one after another, the first one matching at least one secondary is used
+        tag_sets = self.configuration.mongo_read_preference_tag_sets()
+        if len(tag_sets) > 0:
+            matching_secondaries = []
+            for tag_set in tag_sets:
+                matching_secondaries = [member for member in secondaries if all(member.get('tags', {}).get(k) == v for k, v in tag_set.items())]
+                if len(matching_secondaries) > 0:
+                    break
+            secondaries = matching_secondaries
+
+        mode = self.configuration.mongo_read_preference_mode()
+        if mode == 'primary':
+            eligible = primaries
+        elif mode == 'primaryPreferred':
+            eligible = primaries if len(primaries) > 0 else secondaries
+        elif mode == 'secondary':
+            eligible = secondaries
+        elif mode == 'secondaryPreferred':
+            eligible = secondaries if len(secondaries) > 0 else primaries
+        else: # nearest
+            eligible = primaries + secondaries
+
+        return [member['host'] for member in eligible]
 
     """
         Create a collection, useful for a cappped collection
@@ -109,11 +187,15 @@ class Mongo:
     """
         A generic find function, which might be problematic to handle if we get a connection error while iterating on it.
         It needs to be handle on the caller side to avoid any problem.
+        With raw=True, the documents are not decoded (RawBSONDocument), useful if we only want to write them somewhere else.
     """
     @retry_connection
-    def find(self, db, coll, query, skip=0, limit=0, projection=None, sort_field = '_id', sort_order=pymongo.ASCENDING):
+    def find(self, db, coll, query, skip=0, limit=0, projection=None, sort_field = '_id', sort_order=pymongo.ASCENDING, raw=False):
         # cursor_type=pymongo.CursorType.EXHAUST
-        com = self.instance[db][coll].find(query, projection, no_cursor_timeout=True)
+        collection = self.instance[db][coll]
+        if raw:
+            collection = collection.with_options(codec_options=CodecOptions(document_class=RawBSONDocument))
+        com = collection.find(query, projection, no_cursor_timeout=True)
         if skip > 0:
             com = com.skip(skip)
         if limit > 0:
@@ -123,6 +205,23 @@ class Mongo:
 
         return com
 
+    """
+        Find every document between two values of a given index (typically the boundaries of a chunk of a sharded collection,
+        expressed with the shard key). The min is inclusive, the max exclusive. As for the find, the caller must handle any
+        connection error while iterating on the cursor.
+        With raw=True, the documents are not decoded (RawBSONDocument).
+    """
+    @retry_connection
+    def find_range(self, db, coll, key_pattern, min_key, max_key, skip=0, raw=False):
+        collection = self.instance[db][coll]
+        if raw:
+            collection = collection.with_options(codec_options=CodecOptions(document_class=RawBSONDocument))
+        com = collection.find({}, no_cursor_timeout=True).hint(list(key_pattern.items()))
+        com = com.min(list(min_key.items())).max(list(max_key.items()))
+        if skip > 0:
+            com = com.skip(skip)
+        return com
+
     """
         A specific find method to read the oplog with a tailable cursor
     """
@@ -140,56 +239,64 @@ class Mongo:
         return self.instance["local"]["oplog.rs"].find(query, projection, no_cursor_timeout=True, cursor_type=pymongo.CursorType.TAILABLE_AWAIT, oplog_replay=True).skip(skip).limit(limit)
 
     """
-        A FindOneAndUpdate which always return the document after modification
+        Information about the current oplog: first and last "ts", current size and maximum size (in bytes). Return None if
+        there is no oplog.
     """
     @retry_connection
-    def find_one_and_update(self, db, coll, query, update):
-        result = self.instance[db][coll].find_one_and_update(query, update, return_document=ReturnDocument.AFTER)
-        return result
+    def oplog_window(self):
+        oplog = self.instance["local"]["oplog.rs"]
+        first = list(oplog.find({}, {'ts': 1}).sort('$natural', pymongo.ASCENDING).limit(-1))
+        last = list(oplog.find({}, {'ts': 1}).sort('$natural', pymongo.DESCENDING).limit(-1))
+        if len(first) == 0 or len(last) == 0:
+            return None
+        stats = self.collection_stats(db="local", coll="oplog.rs")
+        return {'first_ts': first[0]['ts'], 'last_ts': last[0]['ts'], 'size': stats.get('size', 0), 'max_size': stats.get('maxSize', 0)}
 
     """
-        A list of ids from a given collection, which could be use to "equally" split the collection. Return an empty list if not possible to do it.
-        Duplicate seeds are possible. _ids are not returned in any specific order.
+        Read every oplog entry in ]start_ts; end_ts], without any tailable cursor. As for the find, the caller must handle
+        any connection error while iterating on the cursor.
     """
-    def section_ids(self, db, coll, quantity):
-        # The "$sample" is slow, so we will try to generate random object ids ourselves
-
-        # We want to have some information about the smallest and biggest _id (we suppose that the _id is monotonously increasing)
-        first = list(self.find(db=db, coll=coll, query={}, skip=0, limit=1, projection=None, sort_field='_id', sort_order=pymongo.ASCENDING))
-        if len(first) == 0:
-            return []
-        last = list(self.find(db=db, coll=coll, query={}, skip=0, limit=1, projection=None, sort_field='_id', sort_order=pymongo.DESCENDING))
-        if len(last) == 0:
-            return []
-        first = first[0]
-        last = last[0]
-
-        # Arbitrarily generate object ids between the minimal/maximal values
-        first_timestamp = first['_id'].generation_time.replace(tzinfo=timezone.utc).timestamp()
-        last_timestamp = last['_id'].generation_time.replace(tzinfo=timezone.utc).timestamp()
-        step = int(max(1,(last_timestamp - first_timestamp) / quantity))
-        section_ids = []
-        for offset in range(int(first_timestamp), int(last_timestamp), step):
-            current_date = datetime.utcfromtimestamp(offset)
-            section_id = {'_id':ObjectId.from_datetime(current_date)}
-            section_ids.append(section_id)
+    @retry_connection
+    def find_oplog_range(self, start_ts, end_ts):
+        return self.instance["local"]["oplog.rs"].find({'ts': {'$gt': start_ts, '$lte': end_ts}}, no_cursor_timeout=True, oplog_replay=True)
 
-        return section_ids
+    """
+        Number of documents matching a query
+    """
+    @retry_connection
+    def count(self, db, coll, query):
+        return self.instance[db][coll].count_documents(query)
 
     """
-        Indicates if the collection contains at least one document with an "_id" field, and if it's an ObjectId 
+        Apply oplog entries (read from another node) with the applyOps command. The no-op entries, the ones of the chunk
+        migrations (their documents are already written by the oplog of the other shard) and the ones of the internal
+        databases are ignored. The collection UUIDs are removed, as they are different on this node.
     """
-    def id_type(self, db, coll):
-        first = list(self.find(db=db, coll=coll, query={}, skip=0, limit=1, projection=None, sort_field='_id', sort_order=pymongo.ASCENDING))
-        if len(first) == 0:
-            return {'has_id':False,'is_object_id':False}
-        first = first[0]
+    @retry_connection
+    def apply_oplog(self, entries):
+        operations = []
+        for entry in entries:
+            db = entry['ns'].split('.')[0]
+            if entry['op'] == 'n' or entry.get('fromMigrate', False) or db in ['config', 'local']:
+                continue
+            if db == 'admin' and 'applyOps' not in entry['o']: # Only keep the transactions
+                continue
+            operation = {key: value for key, value in entry.items() if key != 'ui'}
+            if 'applyOps' in operation['o']:
+                operation['o'] = dict(operation['o'])
+                operation['o']['applyOps'] = [{key: value for key, value in op.items() if key != 'ui'} for op in operation['o']['applyOps']]
+            operations.append(operation)
+        if len(operations) > 0:
+            self.instance.admin.command('applyOps', operations)
+        return len(operations)
 
-        has_id = '_id' in first
-        is_object_id = False
-        if has_id:
-            is_object_id = isinstance(first['_id'], ObjectId)
-        return {'has_id':has_id,'is_object_id':is_object_id}
+    """
+        A FindOneAndUpdate which always return the document after modification
+    """
+    @retry_connection
+    def find_one_and_update(self, db, coll, query, update):
+        result = self.instance[db][coll].find_one_and_update(query, update, return_document=ReturnDocument.AFTER)
+        return result
 
     """
         A simple insert_one
@@ -198,22 +305,46 @@ class Mongo:
     def insert_one(self, db, coll, document):
         return self.instance[db][coll].insert_one(document)
 
+    """
+        While profiling, the documents are encoded here (pymongo sends the RawBSONDocuments as they are), so the encoding is
+        measured on its own: it is done within the server round trips otherwise. Return the documents as they are otherwise.
+    """
+    @staticmethod
+    def encode(documents):
+        if not Profiler.enabled():
+            return documents
+        with Profiler.phase('encode'):
+            return [doc if isinstance(doc, RawBSONDocument) else RawBSONDocument(BSON.encode(doc)) for doc in documents]
+
     """
         A simple insert_many
     """
     @retry_connection
     def insert_many(self, db, coll, documents):
         try:
-            result = self.instance[db][coll].insert_many(documents, ordered=False, bypass_document_validation=True)
+            with Profiler.phase('insert_many'):
+                result = self.instance[db][coll].insert_many(Mongo.encode(documents), ordered=False, bypass_document_validation=True)
         except pymongo.errors.BulkWriteError as e:
             # We don't want to crash on duplicate key errors
-            for err in e.details.get('writeErrors', []):
-                if err['code'] != 11000:
-                    print(e.details)
-                    raise e
+            with Profiler.phase('duplicate_key'):
+                for err in e.details.get('writeErrors', []):
+                    if err['code'] != 11000:
+                        print(e.details)
+                        raise e
             result = []
         return result
 
+    """
+        An idempotent alternative to the insert_many: every document replaces the one with the same _id, or is inserted if
+        it does not exist yet. Used to write into non-empty targets without going through the duplicate key errors.
+        Every document must have an _id.
+    """
+    @retry_connection
+    def upsert_many(self, db, coll, documents):
+        operations = [ReplaceOne({'_id': document['_id']}, encoded, upsert=True) for document, encoded in zip(documents, Mongo.encode(documents))]
+        with Profiler.phase('upsert_many'):
+            return self.instance[db][coll].bulk_write(operations, ordered=False, bypass_document_validation=True)
+
     """
         Stats on a given collection
     """
@@ -252,6 +383,81 @@ class Mongo:
     def delete_many(self, db, coll, query):
         return self.instance[db][coll].delete_many(query)
 
+    """
+        List the shards of a sharded cluster (we must be connected to a mongos)
+        [{'_id': <shard_id>, 'host': '<replica_set>/<host1>,<host2>'}]
+    """
+    @retry_connection
+    def list_shards(self):
+        return list(self.instance['config']['shards'].find({}))
+
+    """
+        Information about a sharded collection (config.collections), or None if the collection is not sharded
+    """
+    @retry_connection
+    def sharded_collection(self, db, coll):
+        return self.instance['config']['collections'].find_one({'_id': db + '.' + coll, 'dropped': {'$ne': True}})
+
+    """
+        List the chunks of a sharded collection, ordered by their lower boundary. Depending on the MongoDB version, the
+        chunks are linked to the collection through the namespace or through its uuid.
+    """
+    @retry_connection
+    def list_chunks(self, sharded_collection):
+        query = {'ns': sharded_collection['_id']}
+        if 'uuid' in sharded_collection and self.instance['config']['chunks'].find_one(query) is None:
+            query = {'uuid': sharded_collection['uuid']}
+        return list(self.instance['config']['chunks'].find(query).sort('min', pymongo.ASCENDING))
+
+    """
+        The primary shard of a database, where its unsharded collections are stored. None if the database has no primary
+        shard (the "admin" database for example).
+    """
+    @retry_connection
+    def database_primary_shard(self, db):
+        database = self.instance['config']['databases'].find_one({'_id': db})
+        return database.get('primary', None) if database is not None else None
+
+    """
+        Indicates if the balancer of a sharded cluster is enabled (we must be connected to a mongos)
+    """
+    @retry_connection
+    def balancer_enabled(self):
+        return self.instance['admin'].command('balancerStatus').get('mode', 'off') != 'off'
+
+    """
+        Stop the balancer of a sharded cluster. The command waits for the end of the current balancing round.
+    """
+    @retry_connection
+    def stop_balancer(self):
+        self.instance['admin'].command('balancerStop')
+
+    """
+        Start the balancer of a sharded cluster
+    """
+    @retry_connection
+    def start_balancer(self):
+        self.instance['admin'].command('balancerStart')
+
+    """
+        Indicates if a chunk migration is in progress: a balancing round, or a migration started manually (moveChunk),
+        which is registered in config.migrations.
+    """
+    @retry_connection
+    def migration_in_progress(self):
+        if self.instance['admin'].command('balancerStatus').get('inBalancerRound', False):
+            return True
+        return self.instance['config']['migrations'].count_documents({}) > 0
+
+    """
+        Number of bytes sent by the server on the network since its start. We prefer the physical bytes (after the
+        compression) if the server gives them.
+    """
+    @retry_connection
+    def network_bytes_out(self):
+        network = self.instance.admin.command('serverStatus')['network']
+        return network.get('physicalBytesOut', network['bytesOut'])
+
     """
         List all databases
     """
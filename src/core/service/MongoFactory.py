@@ -0,0 +1,14 @@
+from src.core.service.Mongo import Mongo
+from src.core.service.FakeMongo import FakeMongo
+
+"""
+    Create the appropriate backend to access a MongoDB node, depending on the configuration: "mongodb" (default) to use
+    real nodes, or "fake" to use in-memory nodes (benchmarks and tests without any server).
+"""
+class MongoFactory:
+
+    @staticmethod
+    def create(configuration, is_primary, host=None, compressors=None):
+        if configuration.mongo_backend() == 'fake':
+            return FakeMongo(configuration, is_primary, host=host)
+        return Mongo(configuration, is_primary, host=host, compressors=compressors)
@@ -0,0 +1,198 @@
+import collections
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pymongo import monitoring
+
+"""
+    Listener receiving every command sent to MongoDB, to know the time spent in the server round trips (network + server
+    time) for each type of command.
+"""
+class ProfilerCommandListener(monitoring.CommandListener):
+    def __init__(self, profiler):
+        self.profiler = profiler
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self.profiler.add('round_trip.' + event.command_name, event.duration_micros / 1000000)
+
+    def failed(self, event):
+        self.profiler.add('round_trip.' + event.command_name, event.duration_micros / 1000000)
+
+"""
+    Hot-path profiling of a worker process, only enabled with the "--profile" option. It records the time spent in every
+    phase of the sync (cursor fetch, decoding, encoding, insert, duplicate key handling, server round trips) and can optionally
+    run a sampling profiler writing flame-graph-ready output (folded stacks, to use with flamegraph.pl or speedscope).
+    Every process writes its own files in the profile directory, they are merged at the end by the Core.
+"""
+class Profiler:
+    # Profiler of the current process, None if the profiling is disabled
+    CURRENT = None
+
+    def __init__(self, directory, name, sampling_interval=None, dump_interval=30):
+        self.directory = directory
+        self.name = name
+        self.sampling_interval = sampling_interval
+        self.dump_interval = dump_interval
+        self.timers = {}
+        self.stacks = collections.Counter()
+        self.lock = threading.Lock()
+
+        os.makedirs(self.directory, exist_ok=True)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    """
+        Enable the profiling for the current process
+    """
+    @staticmethod
+    def enable(configuration, name):
+        sampling_interval = None
+        if configuration.internal_profile_sampling():
+            sampling_interval = configuration.internal_profile_sampling_interval() / 1000
+        Profiler.CURRENT = Profiler(configuration.internal_profile_directory(), name, sampling_interval=sampling_interval)
+        return Profiler.CURRENT
+
+    """
+        Remove the profiles of a previous run from the directory, otherwise they would be merged with the current ones
+    """
+    @staticmethod
+    def clear(directory):
+        if not os.path.isdir(directory):
+            return
+        for filename in os.listdir(directory):
+            if filename.endswith('.json') or filename.endswith('.folded'):
+                os.remove(os.path.join(directory, filename))
+
+    """
+        Time a given phase of the current process, do nothing if the profiling is disabled:
+            with Profiler.phase('cursor_fetch'):
+                ...
+    """
+    @staticmethod
+    @contextmanager
+    def phase(name):
+        if Profiler.CURRENT is None:
+            yield
+            return
+        st = time.time()
+        try:
+            yield
+        finally:
+            Profiler.CURRENT.add(name, time.time() - st)
+
+    """
+        Indicates if the profiling is enabled in the current process
+    """
+    @staticmethod
+    def enabled():
+        return Profiler.CURRENT is not None
+
+    """
+        The listeners to give to a MongoClient, empty list if the profiling is disabled
+    """
+    @staticmethod
+    def event_listeners():
+        if Profiler.CURRENT is None:
+            return []
+        return [ProfilerCommandListener(Profiler.CURRENT)]
+
+    """
+        Write the current results of the process, if the profiling is enabled
+    """
+    @staticmethod
+    def flush():
+        if Profiler.CURRENT is not None:
+            Profiler.CURRENT.dump()
+
+    """
+        Add some time to a given phase
+    """
+    def add(self, name, duration):
+        with self.lock:
+            timer = self.timers.setdefault(name, [0, 0])
+            timer[0] += 1
+            timer[1] += duration
+
+    """
+        Background thread, sampling the stacks of the other threads and regularly writing the results
+    """
+    def run(self):
+        last_dump = time.time()
+        own_id = threading.get_ident()
+        while True:
+            if self.sampling_interval is None:
+                time.sleep(self.dump_interval)
+            else:
+                time.sleep(self.sampling_interval)
+                frames = sys._current_frames()
+                with self.lock:
+                    for thread_id, frame in frames.items():
+                        if thread_id != own_id:
+                            self.stacks[Profiler.folded_stack(frame)] += 1
+
+            if time.time() - last_dump >= self.dump_interval:
+                self.dump()
+                last_dump = time.time()
+
+    """
+        Write the timers (json) and the sampled stacks (folded format) of the process
+    """
+    def dump(self):
+        with self.lock:
+            timers = dict(self.timers)
+            stacks = dict(self.stacks)
+        with open(os.path.join(self.directory, self.name + '.json'), 'w') as f:
+            json.dump(timers, f)
+        if self.sampling_interval is not None:
+            Profiler.write_folded(os.path.join(self.directory, self.name + '.folded'), stacks)
+
+    """
+        Merge the results of every process of the profile directory, write a merged folded file and print a summary
+    """
+    @staticmethod
+    def merge(directory):
+        timers = {}
+        stacks = collections.Counter()
+        for filename in sorted(os.listdir(directory)):
+            filepath = os.path.join(directory, filename)
+            if filename.endswith('.json'):
+                with open(filepath, 'r') as f:
+                    for name, (count, duration) in json.load(f).items():
+                        timer = timers.setdefault(name, [0, 0])
+                        timer[0] += count
+                        timer[1] += duration
+            elif filename.endswith('.folded') and filename != 'merged.folded':
+                with open(filepath, 'r') as f:
+                    for line in f:
+                        stack, count = line.rsplit(' ', 1)
+                        stacks[stack] += int(count)
+
+        if len(stacks) > 0:
+            Profiler.write_folded(os.path.join(directory, 'merged.folded'), stacks)
+
+        print('Profiling summary (every worker, '+str(directory)+'):')
+        for name in sorted(timers, key=lambda name: timers[name][1], reverse=True):
+            print('  '+name+': '+str(round(timers[name][1], 2))+'s ('+str(timers[name][0])+' calls)')
+
+    """
+        Stack of a frame in the "folded" format: root;caller;callee
+    """
+    @staticmethod
+    def folded_stack(frame):
+        stack = []
+        while frame is not None:
+            stack.append(os.path.basename(frame.f_code.co_filename) + ':' + frame.f_code.co_name)
+            frame = frame.f_back
+        return ';'.join(reversed(stack))
+
+    @staticmethod
+    def write_folded(filepath, stacks):
+        with open(filepath, 'w') as f:
+            for stack, count in stacks.items():
+                f.write(stack + ' ' + str(count) + '\n')
@@ -0,0 +1,84 @@
+import multiprocessing as mp
+import time
+
+"""
+    Token bucket limiting the bytes/s and the documents/s read from the in-sync node, shared by every worker process (the
+    state is stored in shared memory). The rates can be changed at any time, even while the workers are using it. A rate
+    <= 0 means no limit. Batches bigger than the bucket are accepted, the next callers simply wait longer.
+"""
+class RateLimiter:
+    # Rate limiter of the current process, None if there is no limit
+    CURRENT = None
+
+    def __init__(self, bytes_rate=0, docs_rate=0):
+        self.lock = mp.Lock()
+        self.bytes_rate = mp.Value('d', 0, lock=False)
+        self.docs_rate = mp.Value('d', 0, lock=False)
+        self.bytes_tokens = mp.Value('d', 0, lock=False)
+        self.docs_tokens = mp.Value('d', 0, lock=False)
+        self.last_refill = mp.Value('d', time.time(), lock=False)
+        self.set_rates(bytes_rate, docs_rate)
+
+    """
+        Use the given rate limiter for the current process
+    """
+    @staticmethod
+    def enable(rate_limiter):
+        RateLimiter.CURRENT = rate_limiter
+
+    """
+        Take the given quantity of bytes and documents from the bucket, and wait until the bucket is not in debt anymore
+        (with quantities of 0, only wait for the debt of the other callers). Do nothing if there is no rate limiter in the
+        current process.
+    """
+    @staticmethod
+    def acquire(bytes_quantity, docs_quantity):
+        if RateLimiter.CURRENT is not None:
+            RateLimiter.CURRENT.wait(bytes_quantity, docs_quantity)
+
+    """
+        Maximum number of documents to read at once to stay within ~1 second of the current rates, to avoid reading big
+        bursts at full speed before being throttled. Return the given limit if there is no rate limiter.
+    """
+    @staticmethod
+    def read_limit(limit, average_object_size):
+        if RateLimiter.CURRENT is None:
+            return limit
+        bytes_rate = RateLimiter.CURRENT.bytes_rate.value
+        docs_rate = RateLimiter.CURRENT.docs_rate.value
+        if bytes_rate > 0:
+            limit = min(limit, max(1, int(bytes_rate / max(1, average_object_size))))
+        if docs_rate > 0:
+            limit = min(limit, max(1, int(docs_rate)))
+        return limit
+
+    """
+        Change the rates (bytes/s and documents/s), for every process
+    """
+    def set_rates(self, bytes_rate, docs_rate):
+        with self.lock:
+            if bytes_rate != self.bytes_rate.value or docs_rate != self.docs_rate.value:
+                print('Rate limit: '+(str(int(bytes_rate/1024))+'KB/s' if bytes_rate > 0 else 'unlimited')+', ' +
+                      (str(int(docs_rate))+' docs/s' if docs_rate > 0 else 'unlimited docs/s')+'.')
+            self.bytes_rate.value = bytes_rate
+            self.docs_rate.value = docs_rate
+
+    """
+        Take the tokens from the bucket, and sleep the time needed to refill them if there were not enough of them
+    """
+    def wait(self, bytes_quantity, docs_quantity):
+        with self.lock:
+            now = time.time()
+            elapsed = now - self.last_refill.value
+            self.last_refill.value = now
+            delay = 0
+            for rate, tokens, quantity in [(self.bytes_rate.value, self.bytes_tokens, bytes_quantity), (self.docs_rate.value, self.docs_tokens, docs_quantity)]:
+                if rate <= 0:
+                    tokens.value = 0
+                    continue
+                # The bucket can store up to 1 second of tokens
+                tokens.value = min(rate, tokens.value + elapsed * rate) - quantity
+                if tokens.value < 0:
+                    delay = max(delay, -tokens.value / rate)
+        if delay > 0:
+            time.sleep(delay)
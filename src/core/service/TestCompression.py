@@ -0,0 +1,45 @@
+import time
+import pymongo
+from pymongo.compression_support import validate_compressors
+from src.core.service.MongoFactory import MongoFactory
+
+class TestCompression:
+
+    def __init__(self, configuration):
+        self.configuration = configuration
+        self.db = self.configuration.internal_database()
+        self.coll = self.configuration.internal_test_write_collection()
+        # We need to read from the node on which we look at the network stats, so we directly connect to it
+        self.host = self.configuration.mongo_host_in_sync().split(',')[0]
+
+    """
+        Read the TestWrite collection from the in-sync node with every wire compressor, and compare the bytes sent on the
+        network by the server with the logical bytes of the documents. Other clients of the node will add some noise.
+    """
+    def start(self):
+        print('Reading data from the mongosync database with every compressor, from '+str(self.host)+'.')
+        for compressors in ['', 'snappy', 'zlib', 'zstd']:
+            name = compressors if compressors != '' else 'none'
+            if compressors != '' and len(validate_compressors(None, compressors)) == 0:
+                print('Compressor '+name+': not available, the related python package is probably missing.')
+                continue
+            try:
+                mongo = MongoFactory.create(self.configuration, is_primary=True, host=self.host, compressors=compressors)
+                before = mongo.network_bytes_out()
+            except Exception as e:
+                print('Compressor '+name+': not available ('+str(e)+').')
+                continue
+
+            st = time.time()
+            n = 0
+            logical_bytes = 0
+            cursor = mongo.find(db=self.db, coll=self.coll, query={}, sort_field='_id', sort_order=pymongo.ASCENDING, raw=True)
+            for doc in cursor:
+                n += 1
+                logical_bytes += len(doc.raw)
+            dt = max(time.time() - st, 0.001)
+            wire_bytes = mongo.network_bytes_out() - before
+
+            ratio = wire_bytes / logical_bytes if logical_bytes > 0 else 0
+            print('Compressor '+name+': read '+str(n)+' documents in '+str(round(dt, 2))+'s, logical: '+str(int(logical_bytes/(1024**2)))+'MB, ' +
+                  'on the wire: '+str(int(wire_bytes/(1024**2)))+'MB (ratio: '+str(round(ratio, 3))+', '+str(int(wire_bytes/(dt*1024**2)))+'MB/s on the wire).')
@@ -1,7 +1,7 @@
 import random
 import time
 import pymongo
-from src.core.service.Mongo import Mongo
+from src.core.service.MongoFactory import MongoFactory
 
 class TestRead:
 
@@ -10,8 +10,8 @@ class TestRead:
         self.db = self.configuration.internal_database()
         self.coll = self.configuration.internal_test_write_collection()
 
-        self.primary = Mongo(self.configuration, is_primary=True)
-        self.secondary = Mongo(self.configuration, is_primary=False)
+        self.primary = MongoFactory.create(self.configuration, is_primary=True)
+        self.secondary = MongoFactory.create(self.configuration, is_primary=False)
 
     """
         Small method to loads GBs of data as fast as possible in a mongodb instance, to test the mongosync speed afterwards
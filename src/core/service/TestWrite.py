@@ -1,6 +1,6 @@
 import random
 import time
-from src.core.service.Mongo import Mongo
+from src.core.service.MongoFactory import MongoFactory
 
 class TestWrite:
 
@@ -14,7 +14,7 @@ class TestWrite:
 
         self.string_seed = TestWrite.generate_string_seed(50*int(max(1024,self.document_size)))
 
-        self.mongo = Mongo(self.configuration, is_primary=False)
+        self.mongo = MongoFactory.create(self.configuration, is_primary=False)
 
     """
         Small method to loads GBs of data as fast as possible in a mongodb instance, to test the mongosync speed afterwards
@@ -0,0 +1,43 @@
+import time
+from bson.objectid import ObjectId
+from src.core.service.TestWrite import TestWrite
+from src.core.clone.TargetWriter import TargetWriter
+
+class TestWriteMode(TestWrite):
+
+    def __init__(self, configuration):
+        TestWrite.__init__(self, configuration)
+        self.coll = self.configuration.internal_test_write_collection() + 'Mode'
+        self.documents_quantity = self.configuration.internal_test_write_mode_documents()
+
+    """
+        Benchmark of the write modes, with the same batches as a BasicCollectionPart. The "insert" mode re-inserts the last
+        document of the previous batch (inclusive continuation) and ignores the duplicate key errors, the "upsert" mode uses
+        an exclusive continuation and idempotent bulk replaces. Both are tested on an empty and on an already populated
+        target.
+    """
+    def start(self):
+        print('Generate '+str(self.documents_quantity)+' documents for the benchmark of the write modes.')
+        documents = [{"_id": ObjectId(), "stuff": "hello", "raw": self.random_string_from_seed(self.document_size)} for i in range(self.documents_quantity)]
+        limit_write = int(max(1, 12 * (1024 ** 2) / self.document_size))
+
+        for populated in [False, True]:
+            for write_mode in ['insert', 'upsert']:
+                self.mongo.drop(self.db, self.coll)
+                if populated:
+                    for i in range(0, len(documents), limit_write):
+                        self.mongo.insert_many(self.db, self.coll, documents[i:i + limit_write])
+
+                writer = TargetWriter(self.mongo, self.db, self.coll, '_id', 1, write_mode=write_mode)
+                st = time.time()
+                for i in range(0, len(documents), limit_write):
+                    start = i
+                    if write_mode == 'insert' and i > 0:
+                        start = i - 1 # Same as the "$gte previous_id" of the BasicCollectionPart
+                    writer.write(documents[start:i + limit_write])
+                dt = max(time.time() - st, 0.001)
+                target = 'populated' if populated else 'empty'
+                print('Write mode "'+write_mode+'" on '+target+' target: '+str(len(documents))+' documents in '+str(round(dt, 2))+'s ('+str(int(len(documents)/dt))+' docs/s).')
+
+        self.mongo.drop(self.db, self.coll)
+        print('The end!')
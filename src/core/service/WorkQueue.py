@@ -0,0 +1,120 @@
+import os
+import socket
+import threading
+import time
+from bson.objectid import ObjectId
+from src.core.service.MongoFactory import MongoFactory
+
+"""
+    Queue of the jobs to clone (the inputs of a CollectionPart or of a CollectionPartBatch), stored in a collection of the
+    internal database of the first out-of-sync node, to share them between multiple mongosync instances on different
+    hosts. A job is claimed with a lease, which must be regularly extended by its owner (heartbeat). Once a lease is expired
+    (the owner crashed, or lost its network), the job can be claimed again by anyone. A job can thus be cloned twice,
+    which is not a problem as the writes ignore the duplicate key errors (or are upserts).
+    The leases are based on the clock of each host, so the hosts should be roughly synchronised.
+    Each publication is a new generation of the queue: every job holds its generation, and every query of the queue is
+    restricted to the current one, so a worker of a previous run cannot claim or complete a job of the new one.
+"""
+class WorkQueue:
+    def __init__(self, configuration, generation=None):
+        self.configuration = configuration
+        self.db = configuration.internal_database()
+        self.coll = configuration.internal_work_queue_collection()
+        self.lease = configuration.internal_work_queue_lease()
+        self.owner = socket.gethostname() + ':' + str(os.getpid())
+        self.mongo = MongoFactory.create(configuration, is_primary=False)
+        self.generation = generation
+
+    """
+        Replace the current jobs of the queue by the given ones, as a new generation, and return it. The generation document
+        is written last, so a worker never sees a generation without all its jobs.
+    """
+    def publish(self, inputs_list):
+        self.mongo.drop(self.db, self.coll)
+        self.generation = str(ObjectId())
+        jobs = [{'_id': self.generation+':'+str(i), 'generation': self.generation, 'inputs': inputs, 'state': 'pending', 'owner': None, 'lease_until': 0, 'attempts': 0} for i, inputs in enumerate(inputs_list)]
+        for i in range(0, len(jobs), 1000):
+            self.mongo.insert_many(self.db, self.coll, jobs[i:i + 1000])
+        self.mongo.insert_one(self.db, self.coll, {'_id': 'generation', 'value': self.generation})
+        print('Published '+str(len(jobs))+' jobs in the work queue '+self.db+'.'+self.coll+' (generation '+self.generation+').')
+        return self.generation
+
+    """
+        Read the generation currently published in the queue, and use it. Return None if nothing was published yet.
+    """
+    def load_generation(self):
+        document = self.mongo.find_one(self.db, self.coll, {'_id': 'generation'})
+        self.generation = document['value'] if document is not None else None
+        return self.generation
+
+    """
+        Claim a pending job, or a job with an expired lease. Return None if there is none of them right now.
+    """
+    def claim(self):
+        now = time.time()
+        update = {'$set': {'state': 'claimed', 'owner': self.owner, 'lease_until': now + self.lease}, '$inc': {'attempts': 1}}
+        job = self.mongo.find_one_and_update(self.db, self.coll, {'generation': self.generation, 'state': 'pending'}, update)
+        if job is None:
+            job = self.mongo.find_one_and_update(self.db, self.coll, {'generation': self.generation, 'state': 'claimed', 'lease_until': {'$lt': now}}, update)
+            if job is not None:
+                print('Job '+str(job['_id'])+' of the work queue claimed once again, its previous lease expired.')
+        return job
+
+    """
+        Extend the lease of a job. Return False if we lost it (another instance claimed it in the meantime).
+    """
+    def heartbeat(self, job):
+        query = {'_id': job['_id'], 'generation': self.generation, 'owner': self.owner, 'state': 'claimed'}
+        return self.mongo.find_one_and_update(self.db, self.coll, query, {'$set': {'lease_until': time.time() + self.lease}}) is not None
+
+    """
+        Mark a job as done, only if we still own it. Return False if we lost it (another instance claimed it in the meantime,
+        and will mark it as done by itself).
+    """
+    def complete(self, job):
+        query = {'_id': job['_id'], 'generation': self.generation, 'owner': self.owner, 'state': 'claimed'}
+        return self.mongo.find_one_and_update(self.db, self.coll, query, {'$set': {'state': 'done'}}) is not None
+
+    """
+        Remove the queue, once every job is done
+    """
+    def drop(self):
+        self.mongo.drop(self.db, self.coll)
+        print('Every job of the work queue '+self.db+'.'+self.coll+' is done, the queue is removed.')
+
+    """
+        Number of jobs of the current generation which are not done yet
+    """
+    def remaining(self):
+        return self.mongo.count(self.db, self.coll, {'generation': self.generation, 'state': {'$ne': 'done'}})
+
+    """
+        Number of jobs of the current generation, done or not
+    """
+    def total(self):
+        return self.mongo.count(self.db, self.coll, {'generation': self.generation})
+
+"""
+    Thread extending the lease of a job while it is cloned. Once the lease is lost, "lost" is set and the thread stops.
+"""
+class Heartbeat(threading.Thread):
+    def __init__(self, work_queue, job):
+        threading.Thread.__init__(self, daemon=True)
+        self.work_queue = work_queue
+        self.job = job
+        self.stopped = threading.Event()
+        self.lost = False
+
+    def run(self):
+        while not self.stopped.wait(self.work_queue.lease / 3):
+            try:
+                if not self.work_queue.heartbeat(self.job):
+                    print('Lost the lease of the job '+str(self.job['_id'])+' of the work queue, it might be cloned twice.')
+                    self.lost = True
+                    return
+            except Exception as e:
+                print('Problem while extending the lease of the job '+str(self.job['_id'])+' ('+str(e)+'), try again later.')
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
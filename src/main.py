@@ -1,30 +1,52 @@
 from src.core.service.Configuration import Configuration
 from src.core.Core import Core
+from src.core.Plan import Plan
 from src.core.service.TestWrite import TestWrite
 from src.core.service.TestRead import TestRead
+from src.core.service.TestWriteMode import TestWriteMode
+from src.core.service.TestCompression import TestCompression
 from sys import argv
 
 # python3.6 -m src.main test-write conf/mongosync.json
+# python3.6 -m src.main start conf/mongosync.json --profile
 if __name__ == '__main__':
-    if len(argv) <= 1 or argv[1] not in ['start','test-write','test-read']:
-        print("Usage: <operation> where operation belongs to 'start', 'test-write', 'test-read'")
+    options = [arg for arg in argv[1:] if arg.startswith('--')]
+    args = [arg for arg in argv[1:] if not arg.startswith('--')]
+    if len(args) == 0 or args[0] not in ['start','top-up','worker','plan','test-write','test-read','test-write-mode','test-compression']:
+        print("Usage: <operation> [configuration] [--profile] where operation belongs to 'start', 'top-up', 'worker', 'plan', 'test-write', 'test-read', 'test-write-mode', 'test-compression'")
         exit(1)
-    operation = argv[1]
+    operation = args[0]
 
-    if len(argv) == 3:
-        configuration_filepath = argv[2]
+    if len(args) == 2:
+        configuration_filepath = args[1]
         Configuration.FILEPATH = configuration_filepath
+    Configuration.PROFILE = '--profile' in options
 
     configuration = Configuration()
 
     if operation == 'start':
         core = Core(configuration=configuration)
         core.start()
+    elif operation == 'top-up':
+        core = Core(configuration=configuration)
+        core.top_up()
+    elif operation == 'worker':
+        core = Core(configuration=configuration)
+        core.work()
+    elif operation == 'plan':
+        plan = Plan(configuration=configuration)
+        plan.start()
     elif operation == 'test-write':
         test_write = TestWrite(configuration=configuration)
         test_write.start()
     elif operation == 'test-read':
         test_read = TestRead(configuration=configuration)
         test_read.start()
+    elif operation == 'test-write-mode':
+        test_write_mode = TestWriteMode(configuration=configuration)
+        test_write_mode.start()
+    elif operation == 'test-compression':
+        test_compression = TestCompression(configuration=configuration)
+        test_compression.start()
     else:
         print('Unsupported operation.')
@@ -0,0 +1,73 @@
+#!/bin/bash
+# Local sharded cluster to test the sharded mode against real nodes, on a single host: a config server replica set, two
+# shards (replica sets of one member), a mongos, and an out-of-sync target (replica set of one member). Some data is
+# inserted in a sharded collection (hashed _id, so the chunks are spread over both shards) and in an unsharded one, and a
+# configuration file for mongosync is written in the directory.
+#   ./test/local_sharded_cluster.sh start /tmp/mongosync-cluster
+#   python3.6 -m src.main start /tmp/mongosync-cluster/mongosync.json
+#   ./test/local_sharded_cluster.sh stop /tmp/mongosync-cluster
+# mongod, mongos and mongosh (or the legacy mongo shell) must be in the PATH, and the ports 27200 to 27210 free.
+set -e
+ACTION=${1:-start}
+DIR=${2:-/tmp/mongosync-cluster}
+DOCUMENTS=${3:-100000}
+MONGO_SHELL=$(command -v mongosh || command -v mongo)
+
+if [ "$ACTION" = "stop" ]; then
+    for pidfile in "$DIR"/*.pid; do
+        kill "$(cat "$pidfile")" || true
+        rm -f "$pidfile"
+    done
+    exit 0
+fi
+if [ "$ACTION" != "start" ]; then
+    echo "Usage: $0 start|stop [directory] [documents]"
+    exit 1
+fi
+
+# Start a member and initiate its replica set of one member: <name> <port> <replica set> <mongod options> <rs options>
+start_member() {
+    mkdir -p "$DIR/$1"
+    mongod --dbpath "$DIR/$1" --port "$2" --replSet "$3" $4 --bind_ip localhost --fork --logpath "$DIR/$1.log" --pidfilepath "$DIR/$1.pid"
+    $MONGO_SHELL --quiet --port "$2" --eval "rs.initiate({_id: '$3', $5 members: [{_id: 0, host: 'localhost:$2'}]})"
+    $MONGO_SHELL --quiet --port "$2" --eval "while (!db.isMaster().ismaster) { sleep(200); }"
+}
+
+mkdir -p "$DIR"
+start_member config 27200 config "--configsvr" "configsvr: true,"
+start_member shard0 27201 shard0 "--shardsvr" ""
+start_member shard1 27202 shard1 "--shardsvr" ""
+start_member target 27203 target "" ""
+mongos --configdb config/localhost:27200 --port 27210 --bind_ip localhost --fork --logpath "$DIR/mongos.log" --pidfilepath "$DIR/mongos.pid"
+
+$MONGO_SHELL --quiet --port 27210 --eval "
+    sh.addShard('shard0/localhost:27201');
+    sh.addShard('shard1/localhost:27202');
+    sh.enableSharding('test');
+    sh.shardCollection('test.events', {_id: 'hashed'});
+    for (var i = 0; i < $DOCUMENTS; i += 1000) {
+        var events = [];
+        for (var j = i; j < Math.min(i + 1000, $DOCUMENTS); j++) {
+            events.push({_id: ObjectId(), i: j, payload: 'x'.repeat(1024)});
+        }
+        db.getSiblingDB('test').events.insertMany(events);
+    }
+    for (var j = 0; j < 100; j++) {
+        db.getSiblingDB('test').small.insertOne({i: j});
+    }
+    print('Chunks per shard: ' + JSON.stringify(db.getSiblingDB('config').chunks.aggregate([{\$group: {_id: '\$shard', chunks: {\$sum: 1}}}]).toArray()));
+"
+
+python3 - "$DIR" "$(dirname "$0")/../conf/mongosync.json" <<'EOF'
+import json, os, sys
+with open(sys.argv[2], 'r') as f:
+    conf = json.load(f)
+conf['mongo']['host']['in_sync'] = 'localhost:27210'
+conf['mongo']['host']['out_of_sync'] = 'localhost:27203'
+conf['mongo']['host']['in_sync_replica_set'] = None
+conf['mongo']['sharded'] = True
+conf['mongo']['oplog_size_GB'] = 1
+with open(os.path.join(sys.argv[1], 'mongosync.json'), 'w') as f:
+    json.dump(conf, f, indent=2)
+EOF
+echo "Cluster started, mongos on localhost:27210, target on localhost:27203. Configuration: $DIR/mongosync.json"
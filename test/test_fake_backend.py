@@ -0,0 +1,114 @@
+import json
+import os
+import tempfile
+import unittest
+from bson.objectid import ObjectId
+from src.core.service.Configuration import Configuration
+from src.core.service.FakeMongo import FakeMongo
+from src.core.service.MongoFactory import MongoFactory
+from src.core.clone.Collection import Collection
+from src.core.clone.BasicCollectionPart import BasicCollectionPart
+from src.core.Core import Core
+
+"""
+    Planning and cloning of a few collections with the fake backend, without any MongoDB server. Everything runs in the
+    current process, so the targets can be directly checked.
+"""
+class TestFakeBackend(unittest.TestCase):
+    DATABASES = {
+        'fake': {
+            'events': {'documents': 5000, 'document_bytes': 100},
+            'small': {'documents': 10, 'document_bytes': 10},
+            'empty': {'documents': 0}
+        }
+    }
+
+    def setUp(self):
+        with open(os.path.join(os.path.dirname(__file__), '..', 'conf', 'mongosync.json'), 'r') as f:
+            conf = json.load(f)
+        conf['mongo']['backend'] = 'fake'
+        conf['mongo']['fake']['databases'] = TestFakeBackend.DATABASES
+        conf['internal']['maximum_seeds'] = 10
+        conf['internal']['small_collections_job_MB'] = 1
+
+        self.directory = tempfile.TemporaryDirectory()
+        Configuration.FILEPATH = os.path.join(self.directory.name, 'mongosync.json')
+        with open(Configuration.FILEPATH, 'w') as f:
+            json.dump(conf, f)
+        self.configuration = Configuration()
+
+        # Every test starts with new nodes
+        FakeMongo.NODES = {}
+        FakeMongo.BYTES_OUT = {}
+        self.primary = MongoFactory.create(self.configuration, is_primary=True)
+        self.secondaries = [MongoFactory.create(self.configuration, is_primary=False)]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def collection(self, coll):
+        return Collection(configuration=self.configuration, db='fake', coll=coll, mongo_primary=self.primary, mongo_secondaries=self.secondaries)
+
+    def clone(self, coll, write_mode=None):
+        quantity = 0
+        for inputs in self.collection(coll).prepare_sync():
+            collection_part = BasicCollectionPart(configuration=self.configuration, mongo_primary=self.primary, mongo_secondaries=self.secondaries,
+                                                  write_mode=write_mode, **inputs)
+            quantity += collection_part.sync()['quantity']
+        return quantity
+
+    def ids(self, mongo, coll):
+        return [doc['_id'] for doc in mongo.find('fake', coll, query={})]
+
+    def test_list_seeds(self):
+        seeds = self.collection('events').list_seeds()
+        self.assertGreater(len(seeds), 2)
+        self.assertEqual(seeds[0]['_id'], ObjectId('0' * 24))
+        self.assertEqual(seeds[-1]['_id'], ObjectId('f' * 24))
+        self.assertEqual(seeds, sorted(seeds, key=lambda seed: seed['_id']))
+
+    def test_list_seeds_small_collection(self):
+        seeds = self.collection('small').list_seeds()
+        self.assertEqual(seeds, [{'_id': ObjectId('0' * 24)}, {'_id': ObjectId('f' * 24)}])
+
+    def test_list_seeds_start_id(self):
+        start_id = self.ids(self.primary, 'events')[4000]
+        seeds = self.collection('events').list_seeds(start_id=start_id)
+        self.assertEqual(seeds[0]['_id'], start_id)
+        self.assertTrue(all(seed['_id'] > start_id for seed in seeds[1:]))
+
+    def test_plan_sync(self):
+        collection_parts = self.collection('events').plan_sync()
+        self.assertGreater(len(collection_parts), 1)
+        for previous, current in zip(collection_parts, collection_parts[1:]):
+            self.assertEqual(previous['seed_end'], current['seed_start'])
+        self.assertTrue(all(inputs['total_seeds'] == len(collection_parts) + 1 for inputs in collection_parts))
+        self.assertEqual(collection_parts[0]['coll_stats']['count'], 5000)
+
+    def test_coalesce_small_collections(self):
+        core = Core(configuration=self.configuration)
+        inputs_list = []
+        for coll in ['events', 'small', 'empty']:
+            inputs_list += [{'collection_part': inputs} for inputs in self.collection(coll).plan_sync()]
+        coalesced = core.coalesce_small_collections(inputs_list)
+
+        batches = [data for data in coalesced if 'collection_parts' in data]
+        self.assertEqual(len(batches), 1)
+        self.assertEqual(sorted([inputs['coll'] for inputs in batches[0]['collection_parts']]), ['empty', 'small'])
+        self.assertTrue(all(data['collection_part']['coll'] == 'events' for data in coalesced if 'collection_part' in data))
+
+    def test_sync(self):
+        self.assertGreaterEqual(self.clone('events'), 5000)
+        self.assertEqual(self.ids(self.secondaries[0], 'events'), self.ids(self.primary, 'events'))
+
+    def test_sync_empty_collection(self):
+        self.assertEqual(self.clone('empty'), 0)
+        self.assertEqual(self.ids(self.secondaries[0], 'empty'), [])
+
+    def test_sync_upsert_twice(self):
+        self.clone('small', write_mode='upsert')
+        self.clone('small', write_mode='upsert')
+        self.assertEqual(self.ids(self.secondaries[0], 'small'), self.ids(self.primary, 'small'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import json
+import os
+import tempfile
+import unittest
+from src.core.service.Configuration import Configuration
+from src.core.service.FakeMongo import FakeMongo
+from src.core.service.MongoFactory import MongoFactory
+from src.core.clone.CollectionPartBatch import CollectionPartBatch
+from src.core.clone.OplogCollectionPart import OplogCollectionPart
+from src.core.Core import Core
+
+"""
+    Planning and cloning of a sharded cluster with the fake backend (2 shards), everything in the current process
+"""
+class TestSharded(unittest.TestCase):
+    DATABASES = {
+        'fake': {
+            'events': {'documents': 1000, 'document_bytes': 100, 'sharded': True, 'chunks': 4},
+            'small': {'documents': 10, 'document_bytes': 10}
+        }
+    }
+
+    def setUp(self):
+        with open(os.path.join(os.path.dirname(__file__), '..', 'conf', 'mongosync.json'), 'r') as f:
+            conf = json.load(f)
+        conf['mongo']['backend'] = 'fake'
+        conf['mongo']['sharded'] = True
+        conf['mongo']['fake']['shards'] = 2
+        conf['mongo']['fake']['databases'] = TestSharded.DATABASES
+        conf['internal']['small_collections_job_MB'] = 1
+
+        self.directory = tempfile.TemporaryDirectory()
+        Configuration.FILEPATH = os.path.join(self.directory.name, 'mongosync.json')
+        with open(Configuration.FILEPATH, 'w') as f:
+            json.dump(conf, f)
+        self.configuration = Configuration()
+
+        FakeMongo.NODES = {}
+        FakeMongo.BYTES_OUT = {}
+        FakeMongo.BALANCER = {'enabled': True, 'migration': False}
+        self.core = Core(configuration=self.configuration)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def ids(self, mongo, coll):
+        return [doc['_id'] for doc in mongo.find('fake', coll, query={})]
+
+    def test_prepare_sharded_sync(self):
+        oplog_inputs, other_inputs = self.core.prepare_sharded_sync()
+
+        self.assertEqual([data['collection_part']['source_host'] for data in oplog_inputs], ['shard0/fake-shard0:27017', 'shard1/fake-shard1:27017'])
+        self.assertEqual([data['collection_part']['target_coll'] for data in oplog_inputs], ['oplog.shard0', 'oplog.shard1'])
+        self.assertTrue(all(data['collection_part']['start_ts'] is not None for data in oplog_inputs))
+
+        chunks = [data['collection_part'] for data in other_inputs if 'collection_part' in data]
+        self.assertEqual(len(chunks), 4)
+        self.assertEqual(sorted([inputs['source_host'] for inputs in chunks]), ['shard0/fake-shard0:27017'] * 2 + ['shard1/fake-shard1:27017'] * 2)
+        batches = [data['collection_parts'] for data in other_inputs if 'collection_parts' in data]
+        self.assertEqual([[(inputs['coll'], inputs['source_host']) for inputs in batch] for batch in batches], [[('small', 'shard0/fake-shard0:27017')]])
+
+    def test_clone(self):
+        oplog_inputs, other_inputs = self.core.prepare_sharded_sync()
+        for data in other_inputs:
+            if 'collection_parts' in data:
+                CollectionPartBatch(self.configuration, data['collection_parts']).sync()
+            else:
+                data['collection_part']['configuration'] = self.configuration
+                Core.create_collection_part(inputs=data['collection_part']).sync()
+
+        for coll in ['events', 'small']:
+            self.assertEqual(self.ids(self.core.secondary, coll), self.ids(self.core.primary, coll))
+
+    def test_balancer_stopped_during_clone(self):
+        states = []
+        self.core.run_jobs = lambda oplog_inputs, other_inputs: states.append(self.core.primary.balancer_enabled())
+        self.core.start_sharded_sync()
+        self.assertEqual(states, [False])
+        self.assertTrue(self.core.primary.balancer_enabled())
+
+    def test_migration_in_progress(self):
+        FakeMongo.BALANCER['migration'] = True
+        with self.assertRaises(ValueError):
+            self.core.start_sharded_sync()
+        self.assertTrue(self.core.primary.balancer_enabled())
+
+    def oplog_collection_part(self, start_ts):
+        inputs = self.core.prepare_sharded_sync()[0][0]['collection_part']
+        inputs['start_ts'] = start_ts
+        return OplogCollectionPart(configuration=self.configuration, **inputs)
+
+    def test_apply_copied_oplog(self):
+        shard = MongoFactory.create(self.configuration, is_primary=True, host='shard0/fake-shard0:27017')
+        entries = list(shard.find_oplog_range(None, None))[:100]
+        oplog_collection_part = self.oplog_collection_part(entries[10]['ts'])
+        oplog_collection_part.write_to_targets(entries[:50])
+        oplog_collection_part.apply_entries(entries[50:])
+        self.assertEqual(len(self.ids(self.core.secondary, 'oplog')), 100)
+
+    def test_apply_copied_oplog_with_lost_entries(self):
+        shard = MongoFactory.create(self.configuration, is_primary=True, host='shard0/fake-shard0:27017')
+        entries = list(shard.find_oplog_range(None, None))[:100]
+        # The entries after the start of the clone were removed from the capped collection before being applied
+        oplog_collection_part = self.oplog_collection_part(entries[10]['ts'])
+        oplog_collection_part.write_to_targets(entries[20:50])
+        with self.assertRaises(ValueError):
+            oplog_collection_part.apply_entries(entries[50:])
+
+if __name__ == '__main__':
+    unittest.main()
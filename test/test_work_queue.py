@@ -0,0 +1,121 @@
+import json
+import os
+import tempfile
+import unittest
+from src.core.service.Configuration import Configuration
+from src.core.service.FakeMongo import FakeMongo
+from src.core.service.WorkQueue import WorkQueue, Heartbeat
+
+"""
+    Claims, leases and generations of the work queue, with the fake backend. Every instance of the queue runs in the
+    current process, each one with its own owner.
+"""
+class TestWorkQueue(unittest.TestCase):
+
+    def setUp(self):
+        with open(os.path.join(os.path.dirname(__file__), '..', 'conf', 'mongosync.json'), 'r') as f:
+            conf = json.load(f)
+        conf['mongo']['backend'] = 'fake'
+        conf['internal']['distributed'] = {'enabled': True, 'collection': 'work_queue', 'lease_s': 120}
+
+        self.directory = tempfile.TemporaryDirectory()
+        Configuration.FILEPATH = os.path.join(self.directory.name, 'mongosync.json')
+        with open(Configuration.FILEPATH, 'w') as f:
+            json.dump(conf, f)
+        self.configuration = Configuration()
+
+        FakeMongo.NODES = {}
+        FakeMongo.BYTES_OUT = {}
+        self.publisher = self.instance('publisher')
+        self.publisher.publish([{'collection_part': {'db': 'fake', 'coll': 'coll'+str(i)}} for i in range(3)])
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def instance(self, owner):
+        work_queue = WorkQueue(self.configuration)
+        work_queue.owner = owner
+        work_queue.load_generation()
+        return work_queue
+
+    def expire(self, job):
+        self.publisher.mongo.find_one_and_update(self.publisher.db, self.publisher.coll, {'_id': job['_id']}, {'$set': {'lease_until': 0}})
+
+    def test_claim(self):
+        worker = self.instance('a')
+        jobs = [worker.claim() for i in range(3)]
+        self.assertEqual(sorted([job['inputs']['collection_part']['coll'] for job in jobs]), ['coll0', 'coll1', 'coll2'])
+        self.assertTrue(all(job['owner'] == 'a' and job['attempts'] == 1 for job in jobs))
+        self.assertIsNone(worker.claim())
+        self.assertEqual(worker.remaining(), 3)
+
+        for job in jobs:
+            self.assertTrue(worker.complete(job))
+        self.assertEqual(worker.remaining(), 0)
+        self.assertEqual(worker.total(), 3)
+
+    def test_reclaim_expired_lease(self):
+        worker_a = self.instance('a')
+        worker_b = self.instance('b')
+        jobs = [worker_a.claim() for i in range(3)]
+        self.assertIsNone(worker_b.claim())
+
+        self.expire(jobs[0])
+        job = worker_b.claim()
+        self.assertEqual(job['_id'], jobs[0]['_id'])
+        self.assertEqual(job['owner'], 'b')
+        self.assertEqual(job['attempts'], 2)
+        self.assertTrue(worker_a.heartbeat(jobs[1]))
+
+    def test_complete_after_lost_lease(self):
+        worker_a = self.instance('a')
+        worker_b = self.instance('b')
+        job_a = [worker_a.claim() for i in range(3)][0]
+        self.expire(job_a)
+        job_b = worker_b.claim()
+        self.assertEqual(job_b['_id'], job_a['_id'])
+
+        self.assertFalse(worker_a.heartbeat(job_a))
+        self.assertFalse(worker_a.complete(job_a))
+        self.assertEqual(worker_a.remaining(), 3)
+        self.assertTrue(worker_b.complete(job_b))
+        self.assertEqual(worker_a.remaining(), 2)
+
+    def test_heartbeat_lost_lease(self):
+        worker_a = self.instance('a')
+        worker_a.lease = 0.03
+        job = [worker_a.claim() for i in range(3)][0]
+        self.expire(job)
+        self.assertEqual(self.instance('b').claim()['_id'], job['_id'])
+
+        heartbeat = Heartbeat(worker_a, job)
+        heartbeat.start()
+        heartbeat.join(timeout=5)
+        self.assertTrue(heartbeat.lost)
+
+    def test_stale_generation(self):
+        old_worker = self.instance('a')
+        old_job = old_worker.claim()
+        generation = self.publisher.generation
+
+        self.publisher.publish([{'collection_part': {'db': 'fake', 'coll': 'coll'+str(i)}} for i in range(3)])
+        self.assertNotEqual(self.publisher.generation, generation)
+
+        # A worker of the previous generation cannot claim, extend or complete the jobs of the new one
+        self.assertIsNone(old_worker.claim())
+        self.assertFalse(old_worker.heartbeat(old_job))
+        self.assertFalse(old_worker.complete(old_job))
+        self.assertEqual(self.publisher.remaining(), 3)
+
+        new_worker = self.instance('b')
+        self.assertEqual(new_worker.generation, self.publisher.generation)
+        self.assertEqual(new_worker.claim()['generation'], self.publisher.generation)
+
+    def test_drop(self):
+        self.publisher.drop()
+        worker = WorkQueue(self.configuration)
+        self.assertIsNone(worker.load_generation())
+        self.assertEqual(worker.remaining(), 0)
+
+if __name__ == '__main__':
+    unittest.main()